@@ -0,0 +1,141 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""In memory caches shared by the helpers in this package."""
+
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass
+import threading
+import time
+from typing import Any
+
+
+@dataclass
+class CacheStats:
+    """Counters describing how well a cache is doing."""
+
+    hits: int = 0
+    misses: int = 0
+    size: int = 0
+
+
+class TTLCache:
+    """A bounded LRU cache whose entries expire after a per entry TTL.
+
+    The cache is thread safe. When it is full, the least recently used entry is evicted."""
+
+    def __init__(self, maxsize: int):
+        """Initialize an empty cache."""
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get a fresh value from the cache."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._data.pop(key, None)
+                self._misses += 1
+                return default
+            self._data.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        """Add a value to the cache for ttl seconds."""
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, predicate: None | Callable[[Any], bool] = None):
+        """Drop the entries whose key matches the predicate, or all entries."""
+        with self._lock:
+            if predicate is None:
+                self._data.clear()
+                return
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    @property
+    def stats(self) -> CacheStats:
+        """The current cache counters."""
+        with self._lock:
+            return CacheStats(self._hits, self._misses, len(self._data))
+
+
+class SizedLRUCache:
+    """A thread safe LRU cache of byte strings, bounded by their total size.
+
+    Each value is stored with a tag, such as a modification time, that callers use
+    to check if the value is still current."""
+
+    def __init__(self, max_bytes: int):
+        """Initialize an empty cache."""
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._data: OrderedDict[Hashable, tuple[Any, bytes]] = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key: Hashable, tag: Any) -> None | bytes:
+        """Get a value if it was stored with the same tag."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] != tag:
+                self._misses += 1
+                return None
+            self._data.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def peek_tag(self, key: Hashable) -> Any:
+        """Get the tag a value was stored with, without counting a hit or a miss."""
+        with self._lock:
+            entry = self._data.get(key)
+            return None if entry is None else entry[0]
+
+    def set(self, key: Hashable, tag: Any, value: bytes):
+        """Store a value, evicting the least recently used values to stay in budget."""
+        with self._lock:
+            self._pop(key)
+            if len(value) > self._max_bytes:
+                return
+            self._data[key] = (tag, value)
+            self._bytes += len(value)
+            while self._bytes > self._max_bytes:
+                self._pop(next(iter(self._data)))
+
+    def invalidate(self, key: Hashable):
+        """Drop a value."""
+        with self._lock:
+            self._pop(key)
+
+    def _pop(self, key: Hashable):
+        """Drop a value, the lock must be held."""
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    @property
+    def stats(self) -> CacheStats:
+        """The current cache counters."""
+        with self._lock:
+            return CacheStats(self._hits, self._misses, len(self._data))
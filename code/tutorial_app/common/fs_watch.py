@@ -0,0 +1,221 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Watch the local project files that tests look at.
+
+The watcher keeps an in memory view of every directory that was looked up, with
+the size and modification time of its entries. On Linux, inotify marks a directory
+stale when the kernel reports an event in it, and the directory is scanned again
+on its next lookup, so lookups between events do not touch the disk. Without
+inotify, or for a directory that can not be watched yet because it does not exist,
+the directory is scanned again when its view is older than POLL_INTERVAL seconds."""
+
+from collections.abc import Callable
+import ctypes
+import ctypes.util
+from dataclasses import dataclass
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+
+POLL_INTERVAL = 1
+_LOGGER = logging.getLogger(__file__)
+
+# inotify event masks, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+_EVENT = struct.Struct("iIII")
+
+
+class _Inotify:
+    """A minimal binding of the Linux inotify API, reading events on a background thread."""
+
+    MASK = (
+        IN_MODIFY
+        | IN_ATTRIB
+        | IN_CLOSE_WRITE
+        | IN_MOVED_FROM
+        | IN_MOVED_TO
+        | IN_CREATE
+        | IN_DELETE
+        | IN_DELETE_SELF
+        | IN_MOVE_SELF
+        | IN_ONLYDIR
+    )
+
+    def __init__(self, on_event: Callable[[int, int, str], None]):
+        """Initialize the class. Raises OSError when inotify is not available."""
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._on_event = on_event
+        threading.Thread(target=self._read, name="fs-watch", daemon=True).start()
+
+    def add(self, directory: str) -> int:
+        """Watch a directory, returning the watch descriptor. Raises OSError when it can not be watched."""
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), self.MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), directory)
+        return wd
+
+    def _read(self):
+        """Hand the events to the callback until the process exits."""
+        while True:
+            data = os.read(self._fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+                offset += length
+                try:
+                    self._on_event(wd, mask, name)
+                except Exception:  # pylint: disable=broad-exception-caught
+                    _LOGGER.exception("Handling a file event failed.")
+
+
+@dataclass(frozen=True)
+class Entry:
+    """A directory entry, as of the last scan."""
+
+    is_dir: bool
+    size: int
+    mtime_ns: int
+
+
+@dataclass
+class _View:
+    """What is known about one directory."""
+
+    entries: None | dict[str, Entry] = None
+    scanned: float = float("-inf")
+    stale: bool = True
+    watched: bool = False
+
+
+class FileWatcher:
+    """An in memory view of local directories, kept up to date with inotify or by polling."""
+
+    def __init__(self, poll_interval: float, use_inotify: bool = True):
+        """Initialize the class. Inotify is started on the first lookup."""
+        self._poll_interval = poll_interval
+        self._use_inotify = use_inotify and sys.platform.startswith("linux")
+        self._lock = threading.RLock()
+        self._views: dict[str, _View] = {}
+        self._watches: dict[int, str] = {}
+        self._inotify: None | _Inotify = None
+
+    def _on_event(self, wd: int, mask: int, name: str):
+        """Mark the directories an event is about as stale."""
+        with self._lock:
+            if mask & IN_Q_OVERFLOW:
+                for view in self._views.values():
+                    view.stale = True
+                return
+            directory = self._watches.get(wd)
+            if directory is None:
+                return
+            view = self._views[directory]
+            view.stale = True
+            if mask & IN_IGNORED:
+                # the directory was deleted or moved, and the kernel dropped the watch
+                self._watches.pop(wd)
+                view.watched = False
+            child = self._views.get(os.path.join(directory, name)) if name else None
+            if child is not None:
+                child.stale = True
+
+    def _watch(self, directory: str, view: _View):
+        """Start watching a directory with inotify, if it is available and the directory exists."""
+        if self._use_inotify and self._inotify is None:
+            try:
+                self._inotify = _Inotify(self._on_event)
+            except (OSError, AttributeError) as exc:
+                _LOGGER.info("Watching files by polling, inotify is not available: %s", exc)
+                self._use_inotify = False
+        if self._inotify is None:
+            return
+        try:
+            self._watches[self._inotify.add(directory)] = directory
+            view.watched = True
+        except FileNotFoundError:
+            pass
+        except OSError as exc:
+            # usually the limit of watches was reached
+            _LOGGER.info("Watching %s by polling: %s", directory, exc)
+
+    def _scan(self, directory: str, view: _View):
+        """Read a directory's entries again."""
+        if not view.watched:
+            # watch before scanning, so no change is missed in between
+            self._watch(directory, view)
+        view.stale, view.scanned = False, time.monotonic()
+        try:
+            with os.scandir(directory) as entries:
+                view.entries = {}
+                for entry in entries:
+                    try:
+                        stat = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        # deleted during the scan
+                        continue
+                    view.entries[entry.name] = Entry(entry.is_dir(), stat.st_size, stat.st_mtime_ns)
+        except (FileNotFoundError, NotADirectoryError):
+            view.entries = None
+
+    def _view(self, directory: str) -> _View:
+        """The up to date view of a directory. Call with the lock held."""
+        directory = os.path.normpath(directory)
+        view = self._views.get(directory)
+        if view is None:
+            view = self._views[directory] = _View()
+        fresh = not view.stale if view.watched else time.monotonic() - view.scanned < self._poll_interval
+        if not fresh:
+            self._scan(directory, view)
+        return view
+
+    def listdir(self, directory: str) -> None | list[str]:
+        """The names in a directory, None if it doesn't exist."""
+        with self._lock:
+            entries = self._view(directory).entries
+            return None if entries is None else list(entries)
+
+    def entry(self, path: str) -> None | Entry:
+        """A file or directory's entry, None if it doesn't exist."""
+        directory, name = os.path.split(os.path.normpath(path))
+        with self._lock:
+            return (self._view(directory).entries or {}).get(name)
+
+    def exists(self, path: str) -> bool:
+        """Check if a file or directory exists."""
+        return self.entry(path) is not None
+
+
+WATCHER = FileWatcher(POLL_INTERVAL)
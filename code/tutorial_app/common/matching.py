@@ -0,0 +1,105 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Find several byte patterns in file contents with one scan.
+
+A matcher compiles its patterns into one regular expression that looks ahead at
+every offset, so patterns that overlap are all found. At each offset only the
+longest pattern matches, and the shorter patterns that are its prefixes are
+credited from it. The contents are never decoded to text.
+
+The patterns found are memoized by a digest of the contents, so contents that
+did not change are not scanned again."""
+
+from collections.abc import Callable, Iterable
+from functools import lru_cache
+import hashlib
+import re
+
+from common import cache
+
+MATCH_CACHE_SIZE = 256
+MATCH_TTL = 3600
+_MATCHES = cache.TTLCache(MATCH_CACHE_SIZE)
+
+
+def digest(contents: bytes | bytearray) -> str:
+    """A digest identifying some contents."""
+    return hashlib.blake2b(contents, digest_size=16).hexdigest()
+
+
+class Matcher:
+    """Find which of a set of byte patterns some contents contain."""
+
+    def __init__(self, patterns: frozenset[bytes]):
+        """Compile the patterns."""
+        self.patterns = patterns
+        ordered = sorted((pattern for pattern in patterns if pattern), key=len, reverse=True)
+        alternatives = b"|".join(re.escape(pattern) for pattern in ordered)
+        self._regex = re.compile(b"(?=(" + alternatives + b"))") if ordered else None
+        self._overlap = max((len(pattern) for pattern in patterns), default=1) - 1
+        # the patterns found when a pattern matches, itself and its prefixes
+        self._credits = {
+            pattern: frozenset(other for other in patterns if pattern.startswith(other)) for pattern in ordered
+        }
+        # the empty pattern is in everything
+        self._always = frozenset([b""]) & patterns
+
+    def scan(self, data: bytes | bytearray, start: int = 0) -> frozenset[bytes]:
+        """Scan contents from an offset once, stopping when every pattern was found."""
+        found = set(self._always)
+        if self._regex is not None:
+            for match in self._regex.finditer(data, start):
+                found |= self._credits[match.group(1)]
+                if len(found) == len(self.patterns):
+                    break
+        return frozenset(found)
+
+    def recall(self, key: None | str) -> None | frozenset[bytes]:
+        """The patterns found in the contents with some digest, None if they were not scanned."""
+        return None if key is None else _MATCHES.get((key, self.patterns))
+
+    def find(self, contents: bytes | bytearray, key: None | str = None) -> frozenset[bytes]:
+        """The patterns the contents contain, memoized by the contents' digest.
+
+        Pass a key that identifies the contents, like a file's path and
+        modification time, to skip computing the digest."""
+        key = key or digest(contents)
+        found = self.recall(key)
+        if found is None:
+            found = self.scan(contents)
+            _MATCHES.set((key, self.patterns), found, MATCH_TTL)
+        return found
+
+    def until(self) -> Callable[[bytearray, int], bool]:
+        """A stop predicate for streamed reads that is satisfied once every pattern was found."""
+        found: set[bytes] = set()
+
+        def _until(data: bytearray, new_start: int) -> bool:
+            """Only scan the new bytes, and enough old bytes to catch a pattern split between chunks."""
+            found.update(self.scan(data, max(0, new_start - self._overlap)))
+            return len(found) == len(self.patterns)
+
+        return _until
+
+
+@lru_cache(maxsize=128)
+def _matcher(patterns: frozenset[bytes]) -> Matcher:
+    """Compile a set of patterns once."""
+    return Matcher(patterns)
+
+
+def matcher(patterns: Iterable[bytes]) -> Matcher:
+    """Get the matcher for some patterns, compiled once per set of patterns."""
+    return _matcher(frozenset(patterns))
@@ -0,0 +1,242 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Evaluate the tests of the pages being viewed on a background thread.
+
+Each rerun of a page tells the poller which of its tests are still pending and
+reads back the latest states, without waiting on wb-svc. The poller thread keeps
+evaluating the pending tests of every page that was rendered recently and
+publishes their states in a thread safe store. The tests of a page are evaluated
+concurrently and their states are published up to the first test that does not
+pass. Every page is evaluated on its own worker and a test that does not finish
+within runner.EVAL_TIMEOUT is left pending, so a page waiting on a slow or hung
+wb-svc does not hold up the others.
+
+A page is polled again when the test it is waiting on is due. Tests that wait on
+a slow state, like a container build, back off exponentially up to the cap in
+SLOW_STATES. A user action resets the backoff, and a page without user actions
+for IDLE_AFTER seconds is polled no faster than IDLE_INTERVAL."""
+
+from collections.abc import Callable
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+import logging
+import threading
+import time
+
+from common import runner
+from common.runner import TestState
+
+# the same as the pages' autorefresh, polling faster would not be shown any sooner
+POLL_INTERVAL = 2.5
+# stop polling a page that has not been rendered for this many seconds
+WATCH_TTL = 10
+IDLE_AFTER = 300
+IDLE_INTERVAL = 15
+BACKOFF_FACTOR = 2
+# failure message keys for states that take a while to change, with the longest wait between polls
+SLOW_STATES: dict[str, float] = {
+    "info_build_running": 30,
+    "info_compose_starting": 15,
+    "info_app_starting": 8,
+}
+_LOGGER = logging.getLogger(__file__)
+
+
+class ResultStore:
+    """The latest test states for each watch, safe to share between threads."""
+
+    def __init__(self):
+        """Initialize the class."""
+        self._lock = threading.Lock()
+        self._states: dict[str, dict[str, None | TestState]] = {}
+
+    def get(self, watch_key: str) -> None | dict[str, None | TestState]:
+        """The latest states for a watch, None if it was never evaluated."""
+        with self._lock:
+            return self._states.get(watch_key)
+
+    def publish(self, watch_key: str, states: dict[str, None | TestState]):
+        """Replace the states for a watch."""
+        with self._lock:
+            self._states[watch_key] = states
+
+    def discard(self, watch_key: str):
+        """Forget the states for a watch."""
+        with self._lock:
+            self._states.pop(watch_key, None)
+
+
+class TestSchedule:
+    """How long to wait before evaluating each test of one watch again, based on its last state."""
+
+    def __init__(self, interval: float, slow_states: dict[str, float], factor: float):
+        """Initialize the class."""
+        self._interval = interval
+        self._slow_states = slow_states
+        self._factor = factor
+        self._lock = threading.Lock()
+        self._delays: dict[str, float] = {}
+
+    def delay(self, key: str) -> float:
+        """The time to wait before evaluating a test again."""
+        with self._lock:
+            return self._delays.get(key, self._interval)
+
+    def record(self, key: str, state: None | TestState):
+        """Back off while a test waits on a slow state, otherwise poll at the base interval."""
+        cap = self._slow_states.get(state[1] or "", 0) if state is not None else 0
+        with self._lock:
+            if cap:
+                self._delays[key] = min(self._delays.get(key, self._interval) * self._factor, cap)
+            else:
+                self._delays.pop(key, None)
+
+    def reset(self, keys: list[str]):
+        """Poll tests at the base interval again."""
+        with self._lock:
+            for key in keys:
+                self._delays.pop(key, None)
+
+
+@dataclass
+class _Watch:
+    """The tests one page in one session is waiting on."""
+
+    tests: list
+    seen: float
+    acted: float
+    schedule: TestSchedule
+    polled: float = 0.0
+    busy: bool = False
+    states: dict[str, None | TestState] = field(default_factory=dict)
+
+    @property
+    def head(self) -> None | str:
+        """The key of the first test that has not passed, the one the page waits on."""
+        for test in self.tests:
+            key = runner.test_key(test)
+            state = self.states.get(key)
+            if state is None or not state[0]:
+                return key
+        return None
+
+
+class TestPoller:
+    """Keep evaluating the pending tests of the watched pages."""
+
+    def __init__(self, interval: float, watch_ttl: float, schedule: Callable[[], TestSchedule]):
+        """Initialize the class. Every watch gets its own schedule from the schedule factory."""
+        self._interval = interval
+        self._watch_ttl = watch_ttl
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._watches: dict[str, _Watch] = {}
+        self._thread: None | threading.Thread = None
+        self._schedule = schedule
+        self.results = ResultStore()
+
+    def watch(self, watch_key: str, tests: list, acted: bool = False) -> dict[str, None | TestState]:
+        """Poll the tests for a watch and return their latest states without blocking.
+
+        A watch is usually one page in one browser session. The tests are polled
+        right away when they changed since the last call, or when acted is set to
+        signal a user action."""
+        now = time.monotonic()
+        keys = [runner.test_key(test) for test in tests]
+        with self._lock:
+            watch = self._watches.get(watch_key)
+            changed = watch is None or keys != [runner.test_key(test) for test in watch.tests]
+            if watch is None:
+                watch = self._watches[watch_key] = _Watch(tests, now, now, self._schedule())
+            watch.tests, watch.seen = tests, now
+            if acted or changed:
+                watch.acted, watch.polled = now, 0.0
+                watch.schedule.reset(keys)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="test-poller", daemon=True)
+                self._thread.start()
+
+        if acted or changed:
+            self._wake.set()
+        return self.results.get(watch_key) or {}
+
+    def _due(self, watch: _Watch, now: float) -> bool:
+        """Check if the test a watch is waiting on should be evaluated again."""
+        head = watch.head
+        delay = watch.schedule.delay(head) if head is not None else self._interval
+        if now - watch.acted > IDLE_AFTER:
+            delay = max(delay, IDLE_INTERVAL)
+        return now - watch.polled >= delay
+
+    def _active(self) -> dict[str, list]:
+        """The tests of the watches that are still being rendered and are due, marking them busy."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, watch in self._watches.items() if now - watch.seen > self._watch_ttl]
+            for key in expired:
+                self._watches.pop(key)
+                self.results.discard(key)
+            active = {
+                key: watch
+                for key, watch in self._watches.items()
+                if watch.tests and not watch.busy and self._due(watch, now)
+            }
+            for watch in active.values():
+                # a user action during the evaluation resets polled, so it is polled again right after
+                watch.busy, watch.polled = True, now
+            return {key: watch.tests for key, watch in active.items()}
+
+    def poll(self):
+        """Start evaluating the tests of every watch that is due, without waiting for them."""
+        for watch_key, tests in self._active().items():
+            try:
+                future = runner.submit_tests(tests)
+            except RuntimeError:
+                # the pool was shut down, the process is exiting
+                return
+            future.add_done_callback(lambda done, key=watch_key: self._evaluated(key, done))
+
+    def _evaluated(self, watch_key: str, future: Future):
+        """Publish the states of a watch once its evaluation finished."""
+        if future.cancelled():
+            # the pool is shutting down
+            return
+        states: dict[str, None | TestState] = {}
+        if future.exception() is not None:
+            _LOGGER.error("Background test evaluation failed.", exc_info=future.exception())
+        else:
+            states = future.result()
+        if None in states.values():
+            _LOGGER.warning("A test on %s raised an unexpected exception.", watch_key)
+        with self._lock:
+            watch = self._watches.get(watch_key)
+            if watch is not None:
+                for key, state in states.items():
+                    watch.schedule.record(key, state)
+                watch.busy, watch.states = False, states
+                self.results.publish(watch_key, states)
+
+    def _run(self):
+        """Poll until the process exits."""
+        while True:
+            self._wake.wait(self._interval)
+            self._wake.clear()
+            try:
+                self.poll()
+            except Exception:  # pylint: disable=broad-exception-caught
+                _LOGGER.exception("Background test evaluation failed.")
+
+
+POLLER = TestPoller(POLL_INTERVAL, WATCH_TTL, lambda: TestSchedule(POLL_INTERVAL, SLOW_STATES, BACKOFF_FACTOR))
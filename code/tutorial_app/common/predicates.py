@@ -0,0 +1,421 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Declarative checks for lab steps, written in the page's message catalog.
+
+A task can list checks instead of pointing to a hand written test. The checks
+look at the project named by the catalog's top level project key:
+
+    project: custom-application-project
+    tasks:
+      - name: Create your web app
+        test: create_web_app
+        check:
+          - app: jupyterlab is RUNNING
+          - file: /code/gradio-hello-world.py contains "demo.launch"
+
+The supported checks are:
+
+    project exists
+    build is <BuildState>
+    container is <RunState>[ or <RunState>...]
+    compose is <ComposeState>
+    app: <name> exists
+    app: <name> is <AppState>
+    package: <manager> <name> installed
+    file: <path> exists
+    folder: <path> exists
+    file: <path> contains "<text>"
+
+The text is a JSON string. The checks of a task run in order and the first one
+that fails gives the task's message.
+
+Checks that several tasks depend on can be named under the top level
+prerequisites key, and a task lists the prerequisites or other tasks it
+depends on under requires. A task fails with the message of the first
+prerequisite that fails, and each prerequisite is checked once per evaluation:
+
+    prerequisites:
+      jupyterlab_running:
+        - app: jupyterlab is RUNNING
+    tasks:
+      - name: Create your web app
+        requires: [jupyterlab_running]
+        check:
+          - file: /code/app.py contains "app = Flask(__name__)"
+
+Checks are compiled once per page. All the checks on a page share one query that
+fetches the snapshot fields the checks read together with the metadata of every
+file the page mentions. The patterns a page looks for in a file are found with one
+scan, which is only repeated when the file was modified."""
+
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+from dataclasses import dataclass
+from functools import lru_cache
+import json
+import posixpath
+import re
+from typing import Any, ClassVar
+
+from common import matching, testing, wb_svc_client, wb_svc_files, wb_svc_queries
+from common.snapshot import ProjectSnapshot
+
+
+@dataclass
+class PageView:
+    """The data a page's checks look at, fetched with one query."""
+
+    project_name: str
+    snapshot: ProjectSnapshot
+    files: dict[str, None | dict[str, Any]]
+    # the patterns the page's checks look for, by file path
+    patterns: dict[str, frozenset[bytes]]
+
+    def file(self, path: str) -> dict[str, Any]:
+        """Get a file's metadata, fail the test if it doesn't exist.
+
+        Error message keys:
+            - info_wait_for_file
+        """
+        wb_file = self.files.get(path)
+        if wb_file is None:
+            raise testing.TestFail("info_wait_for_file")
+        return wb_file
+
+    def found(self, path: str) -> frozenset[bytes]:
+        """The patterns the page looks for that a file contains.
+
+        All of the file's patterns are found with one scan, and the result is kept
+        while the file is unmodified, so an unmodified file is not read again.
+
+        Error message keys:
+            - info_wait_for_file
+            - info_file_too_large
+        """
+        wb_file = self.file(path)
+        pattern_matcher = matching.matcher(self.patterns.get(path, ()))
+        modified_at = wb_file.get("modifiedAt")
+        key = f"{self.project_name}:{path}@{modified_at}" if modified_at is not None else None
+        found = pattern_matcher.recall(key)
+        if found is not None:
+            return found
+
+        directory, filename = posixpath.split(path)
+        try:
+            contents = wb_svc_files.read_file(
+                self.project_name, directory, filename, until=pattern_matcher.until(), modified_at=modified_at
+            )
+        except wb_svc_files.FileTooLarge:
+            raise testing.TestFail("info_file_too_large")
+        if contents is None:
+            raise testing.TestFail("info_wait_for_file")
+        return pattern_matcher.find(contents, key)
+
+
+@dataclass(frozen=True)
+class Predicate(ABC):
+    """A compiled check."""
+
+    # the snapshot fields the check reads
+    FIELDS: ClassVar[frozenset[str]] = frozenset()
+
+    text: str
+
+    @property
+    def files(self) -> tuple[str, ...]:
+        """The paths of the files this check looks at."""
+        return ()
+
+    @abstractmethod
+    def check(self, view: PageView) -> Any:
+        """Fail the test if the check does not hold."""
+
+
+@dataclass(frozen=True)
+class ProjectExists(Predicate):
+    """The project exists."""
+
+    def check(self, view: PageView) -> Any:
+        return None
+
+
+@dataclass(frozen=True)
+class BuildIs(Predicate):
+    """The project's environment build is in a state."""
+
+    FIELDS = testing.BUILD_FIELDS
+
+    state: testing.BuildState
+
+    def check(self, view: PageView) -> Any:
+        testing.ensure_build_state(view.snapshot, self.state)
+
+
+@dataclass(frozen=True)
+class ContainerIs(Predicate):
+    """The project's container is in one of some states."""
+
+    FIELDS = testing.RUN_FIELDS
+
+    states: tuple[testing.RunState, ...]
+
+    def check(self, view: PageView) -> Any:
+        testing.ensure_run_state(view.snapshot, list(self.states))
+
+
+@dataclass(frozen=True)
+class ComposeIs(Predicate):
+    """The project's Docker Compose is in a state."""
+
+    FIELDS = testing.COMPOSE_FIELDS
+
+    state: testing.ComposeState
+
+    def check(self, view: PageView) -> Any:
+        testing.ensure_compose_state(view.snapshot, self.state)
+
+
+@dataclass(frozen=True)
+class AppIs(Predicate):
+    """An application exists, and is in a state when one is given."""
+
+    FIELDS = testing.APP_FIELDS
+
+    name: str
+    state: None | testing.AppState = None
+
+    def check(self, view: PageView) -> Any:
+        app = testing.get_app(view.snapshot, self.name)
+        if self.state is not None:
+            testing.ensure_app_state(app, self.state)
+        return app
+
+
+@dataclass(frozen=True)
+class PackageInstalled(Predicate):
+    """A package is installed by a package manager."""
+
+    FIELDS = testing.PACKAGE_FIELDS
+
+    manager: str
+    name: str
+
+    def check(self, view: PageView) -> Any:
+        return testing.ensure_package(view.snapshot, self.manager, self.name)
+
+
+@dataclass(frozen=True)
+class FileExists(Predicate):
+    """A file, or a folder when folder is set, exists."""
+
+    path: str
+    folder: bool = False
+
+    @property
+    def files(self) -> tuple[str, ...]:
+        return (self.path,)
+
+    def check(self, view: PageView) -> Any:
+        if not self.folder:
+            return view.file(self.path)
+        wb_file = view.files.get(self.path)
+        if wb_file is None or not wb_file.get("isDirectory", False):
+            raise testing.TestFail("info_wait_for_folder")
+        return wb_file
+
+
+@dataclass(frozen=True)
+class FileContains(Predicate):
+    """A file contains some text."""
+
+    path: str
+    pattern: bytes
+
+    @property
+    def files(self) -> tuple[str, ...]:
+        return (self.path,)
+
+    def check(self, view: PageView) -> Any:
+        if self.pattern not in view.found(self.path):
+            raise testing.TestFail("info_wait_for_code")
+
+
+_GRAMMAR: list[tuple[re.Pattern, Callable[..., Predicate]]] = [
+    (re.compile(r"project exists"), ProjectExists),
+    (re.compile(r"build is (\w+)"), lambda text, state: BuildIs(text, testing.BuildState(state))),
+    (
+        re.compile(r"container is (\w+(?: or \w+)*)"),
+        lambda text, states: ContainerIs(text, tuple(testing.RunState(state) for state in states.split(" or "))),
+    ),
+    (re.compile(r"compose is (\w+)"), lambda text, state: ComposeIs(text, testing.ComposeState(state))),
+    (re.compile(r"app: (\S+) exists"), AppIs),
+    (re.compile(r"app: (\S+) is (\w+)"), lambda text, name, state: AppIs(text, name, testing.AppState(state))),
+    (re.compile(r"package: (\S+) (\S+) installed"), PackageInstalled),
+    (re.compile(r"file: (\S+) exists"), FileExists),
+    (re.compile(r"folder: (\S+) exists"), lambda text, path: FileExists(text, path, folder=True)),
+    (
+        re.compile(r'file: (\S+) contains (".*")'),
+        lambda text, path, pattern: FileContains(text, path, json.loads(pattern).encode("UTF-8")),
+    ),
+]
+
+
+@lru_cache(maxsize=256)
+def compile_predicate(text: str) -> Predicate:
+    """Compile the text of a check.
+
+    Raises ValueError when the check is not understood."""
+    text = " ".join(text.split())
+    for pattern, factory in _GRAMMAR:
+        match = pattern.fullmatch(text)
+        if match is not None:
+            return factory(text, *match.groups())
+    raise ValueError(f"Unknown check: {text}")
+
+
+@dataclass(frozen=True)
+class CompiledPage:
+    """The compiled checks of a page, and the union of the data they need."""
+
+    project_name: str
+    paths: tuple[str, ...]
+    fields: frozenset[str]
+    patterns: tuple[tuple[str, frozenset[bytes]], ...]
+
+    def view(self) -> PageView:
+        """Fetch the data for all of the page's checks with one query.
+
+        Error message keys:
+            - info_wait_for_project
+        """
+        gql_query = wb_svc_queries.page_query(len(self.paths), self.fields)
+        variables = {}
+        for idx, path in enumerate(self.paths):
+            variables[f"r{idx}"], variables[f"n{idx}"] = posixpath.split(path)
+        response = wb_svc_client.query_project(
+            self.project_name, gql_query.name, variables, wb_svc_client.CACHE_TTLS["snapshot"]
+        )
+
+        project = ((response or {}).get("data") or {}).get("project")
+        if project is None:
+            raise testing.TestFail("info_wait_for_project")
+        files = {path: project.pop(f"f{idx}", None) for idx, path in enumerate(self.paths)}
+        snapshot = ProjectSnapshot(self.project_name, project)
+        return PageView(self.project_name, snapshot, files, dict(self.patterns))
+
+    def test(self, page_name: str, test_name: str, predicates: tuple[Predicate, ...]) -> Callable[[], Any]:
+        """Make a test function that runs checks in order.
+
+        The test is named like a hand written test in the page's test module, so its
+        state is cached under the same key."""
+
+        def _test() -> Any:
+            view = self.view()
+            result = None
+            for predicate in predicates:
+                result = predicate.check(view)
+            return result
+
+        _test.__module__ = f"pages.{page_name}_tests"
+        _test.__name__ = _test.__qualname__ = test_name
+        _test.__doc__ = "; ".join(predicate.text for predicate in predicates)
+        setattr(_test, "fields", self.fields)
+        return _test
+
+
+def _ensure_acyclic(page_name: str, requires: dict[str, tuple[str, ...]]):
+    """Raise ValueError when tests require each other in a cycle."""
+    done: set[str] = set()
+
+    def _visit(test_name: str, path: tuple[str, ...]):
+        if test_name in path:
+            cycle = " -> ".join(path + (test_name,))
+            raise ValueError(f"The {page_name} catalog has a cycle of requirements: {cycle}.")
+        if test_name not in done:
+            for prerequisite in requires.get(test_name, ()):
+                _visit(prerequisite, path + (test_name,))
+            done.add(test_name)
+
+    for test_name in requires:
+        _visit(test_name, ())
+
+
+@lru_cache(maxsize=32)
+def _compile_page(
+    page_name: str,
+    project_name: str,
+    checks: tuple[tuple[str, tuple[str, ...]], ...],
+    requires: tuple[tuple[str, tuple[str, ...]], ...] = (),
+) -> dict[str, Callable[[], Any]]:
+    """Compile the checks of a page's tasks and prerequisites into tests keyed by test name.
+
+    Raises ValueError when a requirement is unknown or the requirements form a cycle."""
+    compiled = {test_name: tuple(compile_predicate(text) for text in texts) for test_name, texts in checks}
+    paths = sorted({path for predicates in compiled.values() for predicate in predicates for path in predicate.files})
+    fields = frozenset().union(*[predicate.FIELDS for predicates in compiled.values() for predicate in predicates])
+    patterns: dict[str, set[bytes]] = {}
+    for predicate in [predicate for predicates in compiled.values() for predicate in predicates]:
+        if isinstance(predicate, FileContains):
+            patterns.setdefault(predicate.path, set()).add(predicate.pattern)
+    page = CompiledPage(
+        project_name,
+        tuple(paths),
+        fields,
+        tuple((path, frozenset(path_patterns)) for path, path_patterns in sorted(patterns.items())),
+    )
+    tests = {test_name: page.test(page_name, test_name, predicates) for test_name, predicates in compiled.items()}
+
+    for test_name, prerequisites in requires:
+        unknown = [name for name in prerequisites if name not in tests]
+        if unknown:
+            raise ValueError(f"The {page_name} task {test_name} requires unknown checks: {', '.join(unknown)}.")
+    _ensure_acyclic(page_name, dict(requires))
+    for test_name, prerequisites in requires:
+        setattr(tests[test_name], "requires", tuple(tests[name] for name in prerequisites))
+    return tests
+
+
+def task_name(task: dict[str, Any]) -> str:
+    """The test name of a task with checks."""
+    return task.get("test") or re.sub(r"\W+", "_", task.get("name", "name").lower()).strip("_")
+
+
+def _check_texts(check: str | dict[str, str] | list[str | dict[str, str]]) -> tuple[str, ...]:
+    """The texts of a task's checks, which YAML parses into one key mappings when they have a colon."""
+    items = check if isinstance(check, list) else [check]
+    return tuple(
+        " ".join(f"{key}: {value}" for key, value in item.items()) if isinstance(item, dict) else str(item)
+        for item in items
+    )
+
+
+def page_tests(page_name: str, messages: dict[str, Any]) -> dict[str, Callable[[], Any]]:
+    """Get the compiled tests for the tasks with checks in a page's catalog, keyed by test name.
+
+    The prerequisites are compiled too, so the result also has their tests.
+
+    Raises ValueError when the catalog has checks but no project, a check is not
+    understood, or a requirement is unknown or cyclic."""
+    tasks = [task for task in messages.get("tasks") or [] if task.get("check") or task.get("requires")]
+    prerequisites = messages.get("prerequisites") or {}
+    checks = tuple((name, _check_texts(check)) for name, check in prerequisites.items()) + tuple(
+        (task_name(task), _check_texts(task.get("check") or [])) for task in tasks
+    )
+    if not checks:
+        return {}
+    if not messages.get("project"):
+        raise ValueError(f"The {page_name} catalog has checks but does not name a project.")
+    requires = tuple((task_name(task), tuple(task["requires"])) for task in tasks if task.get("requires"))
+    return _compile_page(page_name, messages["project"], checks, requires)
@@ -0,0 +1,256 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Run the tests for lab steps and keep their states in the session.
+
+A test's state is a tuple of whether it passed, the failure message key and the
+test's return value. Passing states are cached in the session, so a task stays
+done once it has passed.
+
+Tests can require other tests. Each evaluation runs every test and prerequisite
+at most once, and a test whose prerequisite fails takes the prerequisite's
+failure without running, so a rerun only does the work on the frontier."""
+
+import atexit
+from concurrent.futures import Future, ThreadPoolExecutor
+import logging
+import threading
+import time
+from typing import cast, Any
+
+from common import session, snapshot
+from common.testing import TestFail
+
+TestState = tuple[bool, None | str, None | Any]
+
+# the pages being polled are evaluated concurrently, and so are the tests of a page
+EVAL_WORKERS = 8
+EVAL_TIMEOUT = 5
+# the state of a test that is being evaluated in the background
+PENDING: TestState = (False, None, None)
+# failed results from merge_states, used once by run_test during the same rerun
+_EVALUATED = "testing_evaluated_derived"
+# pages and tests have their own pools, so a page never waits on a test queued behind pages
+_PAGES = ThreadPoolExecutor(EVAL_WORKERS, thread_name_prefix="evaluate_tests")
+_TESTS = ThreadPoolExecutor(EVAL_WORKERS, thread_name_prefix="run_tests")
+atexit.register(_PAGES.shutdown, wait=False, cancel_futures=True)
+atexit.register(_TESTS.shutdown, wait=False, cancel_futures=True)
+# tests that did not finish within the timeout and are still running, by test key
+_OVERDUE: dict[str, Future] = {}
+_OVERDUE_LOCK = threading.Lock()
+_LOGGER = logging.getLogger(__file__)
+
+
+def test_key(fun) -> str:
+    """The session state key where a test's passing state is cached."""
+    mod_name = fun.__module__.split(".")[-1]
+    return mod_name + "_" + fun.__name__
+
+
+def _closure(funs: list) -> list:
+    """A batch of tests together with all of their prerequisites."""
+    found: dict[str, Any] = {}
+    stack = list(funs)
+    while stack:
+        fun = stack.pop()
+        key = test_key(fun)
+        if key not in found:
+            found[key] = fun
+            stack.extend(getattr(fun, "requires", ()))
+    return list(found.values())
+
+
+def _fields(funs: list) -> None | frozenset[str]:
+    """The snapshot fields a batch of tests and their prerequisites read, None when any reads the whole snapshot."""
+    declared = [getattr(fun, "fields", None) for fun in _closure(funs)]
+    selected: list[frozenset[str]] = [fields for fields in declared if fields is not None]
+    if len(selected) < len(declared):
+        return None
+    return frozenset[str]().union(*selected)
+
+
+def _evaluate(fun, fields: None | frozenset[str] = None) -> TestState:
+    """Run a test with a snapshot field selection and capture its state."""
+    try:
+        with snapshot.selecting(fields):
+            return (True, None, fun())
+    except TestFail as exc:
+        return (False, str(exc), None)
+
+
+class Evaluation:
+    """One pass over some tests, evaluating each test and prerequisite once.
+
+    The states can be requested from several threads. The first thread to ask for
+    a test runs it and the others wait on its result, which can not deadlock as
+    the prerequisites form a DAG."""
+
+    def __init__(self, fields: None | frozenset[str] = None):
+        """Initialize the class."""
+        self._fields = fields
+        self._lock = threading.Lock()
+        self._states: dict[str, Future] = {}
+
+    def state(self, fun) -> TestState:
+        """The state of a test, evaluating it and its prerequisites if this pass has not yet."""
+        key = test_key(fun)
+        with self._lock:
+            future = self._states.get(key)
+            owner = future is None
+            if future is None:
+                future = self._states[key] = Future()
+        if owner:
+            try:
+                future.set_result(self._run(fun))
+            except BaseException as exc:
+                future.set_exception(exc)
+                raise
+        return future.result()
+
+    def _run(self, fun) -> TestState:
+        """Evaluate a test, unless one of its prerequisites fails."""
+        for prerequisite in getattr(fun, "requires", ()):
+            passed, msg, _ = self.state(prerequisite)
+            if not passed:
+                return (False, msg, None)
+        return _evaluate(fun, self._fields)
+
+
+def run_test(fun) -> TestState:
+    """Cache the state of a test once it passes."""
+    # importing streamlit outside of the toplevel to prevent
+    # nuisance warnings while developing testing code.
+    # pylint: disable-next=import-outside-toplevel
+    import streamlit as st
+
+    idx = test_key(fun)
+
+    # recall state from cache, if it exists
+    cached_state = st.session_state.get(idx, None)
+    if cached_state is not None:
+        return cast(TestState, cached_state)
+
+    # use the state from merge_states, or run the test to evaluate state
+    state = st.session_state.get(_EVALUATED, {}).pop(idx, None) or Evaluation(_fields([fun])).state(fun)
+    if state[0]:
+        session.put(idx, state)
+
+    return state
+
+
+def pending_tests(funs: list) -> list:
+    """The tests that have not passed in this session, up to the first sequential one."""
+    # pylint: disable-next=import-outside-toplevel
+    import streamlit as st
+
+    pending = []
+    for fun in funs:
+        if st.session_state.get(test_key(fun)) is not None:
+            continue
+        if getattr(fun, "sequential", False):
+            break
+        pending.append(fun)
+    return pending
+
+
+def _start(evaluation: Evaluation, fun) -> Future:
+    """Run a test on the test pool, or join its run that is still going from an earlier evaluation."""
+    key = test_key(fun)
+    with _OVERDUE_LOCK:
+        overdue = _OVERDUE.get(key)
+        if overdue is not None and not overdue.done():
+            return overdue
+    return _TESTS.submit(evaluation.state, fun)
+
+
+def _overdue(key: str, future: Future, timeout: float):
+    """Keep track of a test that did not finish within the timeout until it does."""
+    _LOGGER.warning("The test %s did not finish within %s seconds.", key, timeout)
+
+    def _finished(done: Future):
+        """Forget the test once it finished."""
+        with _OVERDUE_LOCK:
+            if _OVERDUE.get(key) is done:
+                del _OVERDUE[key]
+
+    with _OVERDUE_LOCK:
+        _OVERDUE[key] = future
+    future.add_done_callback(_finished)
+
+
+def evaluate_tests(funs: list, timeout: float = EVAL_TIMEOUT) -> dict[str, None | TestState]:
+    """Evaluate tests concurrently and return their states in order, up to the first test that does not pass.
+
+    The states stop at the first test that fails, that raised an unexpected
+    exception, which maps to None, or that did not finish within timeout, which
+    is left without a state. Tests still queued behind it are cancelled, as
+    run_test would not reach them either. A test that timed out keeps running and
+    later evaluations wait on that run instead of starting it again, so a hung
+    test holds at most one worker. The snapshots are fetched with the union of the
+    fields the tests declare, and prerequisites are shared between the tests.
+    Does not touch the session."""
+    if not funs:
+        return {}
+
+    evaluation = Evaluation(_fields(funs))
+    futures = [_start(evaluation, fun) for fun in funs]
+    deadline = time.monotonic() + timeout
+    states: dict[str, None | TestState] = {}
+    try:
+        for fun, future in zip(funs, futures):
+            key = test_key(fun)
+            try:
+                state = future.result(max(0.0, deadline - time.monotonic()))
+            except TimeoutError:
+                _overdue(key, future, timeout)
+                break
+            except Exception:  # pylint: disable=broad-exception-caught
+                states[key] = None
+                break
+            states[key] = state
+            if not state[0]:
+                break
+    finally:
+        for future in futures:
+            future.cancel()
+    return states
+
+
+def submit_tests(funs: list) -> Future[dict[str, None | TestState]]:
+    """Evaluate tests with evaluate_tests on the page pool."""
+    return _PAGES.submit(evaluate_tests, funs)
+
+
+def merge_states(funs: list, states: dict[str, None | TestState], missing: None | TestState = None):
+    """Merge evaluated states into the session as run_test would see them in order.
+
+    Passing states are cached under the run_test keys up to the first test that
+    fails, and that failure is handed to run_test for this rerun. Later states are
+    thrown away, as tests on a page usually only make sense in order. Tests without
+    a state are given the missing state, or left for run_test to evaluate when it
+    is None. So are tests that raised an unexpected exception, so it surfaces."""
+    # pylint: disable-next=import-outside-toplevel
+    import streamlit as st
+
+    evaluated = {}
+    for fun in funs:
+        key = test_key(fun)
+        state = states[key] if key in states else missing
+        if state is None:
+            break
+        if not state[0]:
+            evaluated[key] = state
+            break
+        session.put(key, state)
+    st.session_state[_EVALUATED] = evaluated
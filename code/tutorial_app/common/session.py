@@ -0,0 +1,87 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Write to the session state and track the keys that changed.
+
+Writes through these helpers mark persisted keys as dirty for the session, so
+saving the state only looks at the keys that changed, and a rerun that changed
+nothing costs one check of an empty set. Keys that a widget writes, outside of
+these helpers, are tracked by rendering the widget inside tracking()."""
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+# the keys changed since the state was last saved
+_DIRTY = "session_dirty_derived"
+_MISSING = object()
+
+
+def _state():
+    """The session state of the current session."""
+    # importing streamlit outside of the toplevel to prevent
+    # nuisance warnings while developing testing code.
+    # pylint: disable-next=import-outside-toplevel
+    import streamlit as st
+
+    return st.session_state
+
+
+def persisted(key: str) -> bool:
+    """Check if a session state key is saved."""
+    # dont save autorefresh runtime var
+    # dont save session scoped variables (*_derived)
+    return key != "autorefresh" and not key.endswith("_derived")
+
+
+def _mark(key: str):
+    """Mark a key as changed, if it is saved."""
+    if persisted(key):
+        state = _state()
+        if _DIRTY not in state:
+            state[_DIRTY] = set()
+        state[_DIRTY].add(key)
+
+
+def put(key: str, value: Any):
+    """Set a session state key."""
+    _state()[key] = value
+    _mark(key)
+
+
+def update(values: dict[str, Any]):
+    """Set several session state keys."""
+    for key, value in values.items():
+        put(key, value)
+
+
+@contextmanager
+def tracking(key: str) -> Iterator[None]:
+    """Track a key that is written outside of these helpers, like by a widget."""
+    before = _state().get(key, _MISSING)
+    try:
+        yield
+    finally:
+        if _state().get(key, _MISSING) != before:
+            _mark(key)
+
+
+def take_dirty() -> dict[str, Any]:
+    """The saved keys that changed since the last call, with their values."""
+    state = _state()
+    dirty = state.get(_DIRTY)
+    if not dirty:
+        return {}
+    state[_DIRTY] = set()
+    return {key: state[key] for key in dirty if key in state}
@@ -0,0 +1,119 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A point in time view of a project, shared by all of a page's tests.
+
+The snapshot is fetched with the single ProjectSnapshot query and its response is
+cached for CACHE_TTLS["snapshot"] seconds, so every test on a page that looks at
+the same project during a rerun reuses one round trip to wb-svc. The snapshot
+objects are shared for as long, with their package index.
+
+Tests can declare the fields they read. The runner then selects only the fields a
+batch of tests needs, so the response stays proportional to what is checked."""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import cached_property
+from typing import Any
+
+from common import cache, wb_svc_client
+
+
+class ProjectSnapshot(dict):
+    """The data for one project, as returned by the ProjectSnapshot query.
+
+    It is the project's GraphQL data, so it can be passed anywhere a project is
+    expected, with accessors for the package and resource data."""
+
+    def __init__(self, project_name: str, data: dict[str, Any]):
+        super().__init__(data)
+        self.project_name = project_name
+
+    # the fields the accessors read, as dotted paths
+    PACKAGE_FIELDS = frozenset(
+        ["environment.packageManagers.name", "environment.packageManagers.installedPackages.name"]
+    )
+    GPU_FIELDS = frozenset(["resources.gpusRequested"])
+    CHANGES_FIELDS = frozenset(
+        ["repoState.addedFilesCount", "repoState.modifiedFilesCount", "repoState.deletedFilesCount"]
+    )
+
+    @property
+    def package_managers(self) -> list[dict[str, Any]]:
+        """The project's package managers and their installed packages."""
+        return (self.get("environment") or {}).get("packageManagers") or []
+
+    @cached_property
+    def packages(self) -> dict[str, dict[str, dict[str, Any]]]:
+        """Index of the installed packages, by package manager and then package name."""
+        return {
+            manager["name"]: {pkg["name"]: pkg for pkg in manager.get("installedPackages") or []}
+            for manager in self.package_managers
+        }
+
+    @property
+    def gpus_requested(self) -> None | int:
+        """The number of GPUs requested by the project."""
+        return (self.get("resources") or {}).get("gpusRequested")
+
+    @property
+    def uncommitted_changes(self) -> int:
+        """The number of files added, modified or deleted since the last commit."""
+        repo_state = self.get("repoState") or {}
+        return sum(repo_state.get(key, 0) for key in ["addedFilesCount", "modifiedFilesCount", "deletedFilesCount"])
+
+
+SNAPSHOT_CACHE_SIZE = 16
+# snapshots are shared while their response is fresh, so derived indexes are built once
+_SNAPSHOTS = cache.TTLCache(SNAPSHOT_CACHE_SIZE)
+# the fields selected for snapshots in the current context, None selects all of them
+_FIELDS: ContextVar[None | frozenset[str]] = ContextVar("snapshot_fields", default=None)
+
+
+@contextmanager
+def selecting(fields: None | frozenset[str]):
+    """Only select some fields, as dotted paths, for the snapshots fetched in this context."""
+    token = _FIELDS.set(fields)
+    try:
+        yield
+    finally:
+        _FIELDS.reset(token)
+
+
+def _unpack(key: tuple[str, None | frozenset[str]], response: None | dict[str, Any]) -> None | ProjectSnapshot:
+    """Pull the project out of a snapshot query response."""
+    project = ((response or {}).get("data") or {}).get("project")
+    if project is None:
+        return None
+    project_snapshot = ProjectSnapshot(key[0], project)
+    _SNAPSHOTS.set(key, project_snapshot, wb_svc_client.CACHE_TTLS["snapshot"])
+    return project_snapshot
+
+
+def get_snapshot(project_name: str) -> None | ProjectSnapshot:
+    """Get a snapshot of a project, None if the project doesn't exist."""
+    key = (project_name, _FIELDS.get())
+    project_snapshot = _SNAPSHOTS.get(key)
+    if project_snapshot is not None:
+        return project_snapshot
+    return _unpack(key, wb_svc_client.get_snapshot(*key))
+
+
+async def aget_snapshot(project_name: str) -> None | ProjectSnapshot:
+    """Get a snapshot of a project, None if the project doesn't exist."""
+    key = (project_name, _FIELDS.get())
+    project_snapshot = _SNAPSHOTS.get(key)
+    if project_snapshot is not None:
+        return project_snapshot
+    return _unpack(key, await wb_svc_client.aget_snapshot(*key))
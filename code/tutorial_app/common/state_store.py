@@ -0,0 +1,311 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Persist the tutorial progress that is shared by all sessions.
+
+The store keeps the persisted state in memory, and sessions hand it only the
+keys that changed. Changes are coalesced: they are saved once the store has been
+quiet for the debounce window, or at the latest after MAX_DELAY.
+
+Where the state is saved is up to a backend, picked by the state file's suffix:
+
+    .json               JsonFileBackend, the whole state in one file, written to
+                        a temporary file that is renamed over the old one so a
+                        crash in the middle of a write keeps the last progress.
+    .sqlite, .db        SqliteBackend, one row per key in an SQLite database in
+                        WAL mode. Only the changed keys are written, in one
+                        transaction, so several processes can share progress.
+
+Both backends can load the keys with a prefix, like the keys of one page."""
+
+from abc import ABC, abstractmethod
+import atexit
+import copy
+import json
+import logging
+import os
+from pathlib import Path
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any
+
+DEBOUNCE = 1.0
+MAX_DELAY = 5.0
+SQLITE_TIMEOUT = 5.0
+_LOGGER = logging.getLogger(__file__)
+
+
+class StateBackend(ABC):
+    """Where the persisted state is saved.
+
+    The store calls a backend with its lock held, so only one call runs at a time."""
+
+    @abstractmethod
+    def load(self, prefix: str = "") -> dict[str, Any]:
+        """Read the saved keys that start with a prefix."""
+
+    @abstractmethod
+    def save(self, state: dict[str, Any], changed: set[str]):
+        """Save the changed keys of the state.
+
+        Raises OSError, or TypeError and ValueError for values that can not be saved."""
+
+    @abstractmethod
+    def clear(self):
+        """Remove all of the saved state."""
+
+
+class JsonFileBackend(StateBackend):
+    """The whole state in one JSON file, replaced atomically on every save."""
+
+    def __init__(self, path: str):
+        """Initialize the class."""
+        self._path = Path(path)
+
+    def load(self, prefix: str = "") -> dict[str, Any]:
+        try:
+            with open(self._path, "r", encoding="UTF-8") as ptr:
+                state = json.load(ptr)
+        except (IOError, OSError, ValueError):
+            return {}
+        return {key: value for key, value in state.items() if key.startswith(prefix)}
+
+    def save(self, state: dict[str, Any], changed: set[str]):
+        state_json = json.dumps(state)
+
+        # write a temporary file and rename it, so the file is always complete
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=self._path.parent, prefix=f".{self._path.name}.")
+        try:
+            with os.fdopen(handle, "w", encoding="UTF-8") as ptr:
+                ptr.write(state_json)
+                ptr.flush()
+                os.fsync(ptr.fileno())
+            os.replace(temp_path, self._path)
+        except OSError:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+
+    def clear(self):
+        self._path.unlink(missing_ok=True)
+
+
+class SqliteBackend(StateBackend):
+    """One row per key in an SQLite database in WAL mode, shared safely between processes."""
+
+    def __init__(self, path: str, timeout: float = SQLITE_TIMEOUT):
+        """Initialize the class. The database is opened on first use."""
+        self._path = Path(path)
+        self._timeout = timeout
+        self._connection: None | sqlite3.Connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database and create the table, the first time."""
+        if self._connection is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            # the store serializes calls, but they come from the session and timer threads
+            connection = sqlite3.connect(self._path, self._timeout, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID"
+            )
+            self._connection = connection
+        return self._connection
+
+    def load(self, prefix: str = "") -> dict[str, Any]:
+        try:
+            connection = self._connect()
+            if prefix:
+                # a range on the primary key, so the lookup uses its index
+                upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+                rows = connection.execute("SELECT key, value FROM state WHERE key >= ? AND key < ?", (prefix, upper))
+            else:
+                rows = connection.execute("SELECT key, value FROM state")
+            return {key: json.loads(value) for key, value in rows}
+        except (OSError, sqlite3.Error):
+            _LOGGER.exception("The tutorial state could not be read from %s.", self._path)
+            return {}
+
+    def save(self, state: dict[str, Any], changed: set[str]):
+        rows = [(key, json.dumps(state[key])) for key in sorted(changed) if key in state]
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany(
+                "INSERT INTO state (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                rows,
+            )
+            connection.execute("COMMIT")
+        except sqlite3.Error as exc:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise OSError(str(exc)) from exc
+
+    def clear(self):
+        try:
+            self._connect().execute("DELETE FROM state")
+        except sqlite3.Error as exc:
+            raise OSError(str(exc)) from exc
+
+
+class StateStore:
+    """The persisted state, saved by a backend in the background."""
+
+    def __init__(self, backend: StateBackend, debounce: float = DEBOUNCE, max_delay: float = MAX_DELAY):
+        """Initialize the class. The state is loaded on first use."""
+        self._backend = backend
+        self._debounce = debounce
+        self._max_delay = max_delay
+        self._lock = threading.Lock()
+        self._state: None | dict[str, Any] = None
+        self._dirty: set[str] = set()
+        self._first_change = 0.0
+        self._last_change = 0.0
+        self._timer: None | threading.Timer = None
+
+    def _loaded(self) -> dict[str, Any]:
+        """The state, loaded from the backend the first time. Call with the lock held."""
+        if self._state is None:
+            self._state = self._backend.load()
+        return self._state
+
+    def load(self, prefix: str = "") -> dict[str, Any]:
+        """A copy of the persisted keys that start with a prefix, for a new session.
+
+        The keys are read again from the backend, which other processes may share,
+        and the changes that were not saved yet are kept."""
+        with self._lock:
+            if self._state is None:
+                state = self._loaded()
+            else:
+                state = self._state
+                saved = self._backend.load(prefix)
+                state.update({key: value for key, value in saved.items() if key not in self._dirty})
+            return copy.deepcopy({key: value for key, value in state.items() if key.startswith(prefix)})
+
+    def changed(self, state: dict[str, Any]) -> dict[str, Any]:
+        """The items of a session's state that differ from the persisted state."""
+        with self._lock:
+            persisted = self._loaded()
+            return {key: value for key, value in state.items() if key not in persisted or persisted[key] != value}
+
+    def update(self, changes: dict[str, Any]):
+        """Persist some changed keys, after the debounce window."""
+        if not changes:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._loaded().update(copy.deepcopy(changes))
+            if not self._dirty:
+                self._first_change = now
+            self._dirty.update(changes)
+            self._last_change = now
+            if self._timer is None:
+                self._schedule(self._debounce)
+
+    def clear(self):
+        """Forget all of the persisted state, including the changes that were not saved yet."""
+        with self._lock:
+            self._state, self._dirty = {}, set()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            try:
+                self._backend.clear()
+            except OSError:
+                _LOGGER.exception("The tutorial state could not be cleared.")
+
+    def _schedule(self, delay: float):
+        """Start the timer for the next write. Call with the lock held."""
+        self._timer = threading.Timer(delay, self._expire)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _expire(self):
+        """Write the state once it was quiet for the debounce window, or changes waited for too long."""
+        with self._lock:
+            self._timer = None
+            now = time.monotonic()
+            quiet_at = self._last_change + self._debounce
+            deadline = self._first_change + self._max_delay
+            if self._dirty and now < min(quiet_at, deadline):
+                self._schedule(min(quiet_at, deadline) - now)
+                return
+        self.flush()
+
+    def flush(self):
+        """Save the changes now, if there are any."""
+        with self._lock:
+            if not self._dirty or self._state is None:
+                return
+            dirty, self._dirty = self._dirty, set()
+            try:
+                try:
+                    self._backend.save(self._state, dirty)
+                except (TypeError, ValueError):
+                    _LOGGER.exception("Some of the tutorial state can not be saved.")
+                    # saving again would fail the same way, so revert the values that can not be saved
+                    unsaveable = {key for key in dirty if not _saveable(self._state.get(key))}
+                    self._revert(unsaveable)
+                    if unsaveable and dirty - unsaveable:
+                        self._backend.save(self._state, dirty - unsaveable)
+            except OSError:
+                _LOGGER.exception("The tutorial state could not be saved.")
+                # try again with the next change
+                self._dirty |= dirty
+
+    def _revert(self, keys: set[str]):
+        """Reset some keys to their saved values, or drop them if they were never saved. Call with the lock held."""
+        if not keys or self._state is None:
+            return
+        _LOGGER.warning("Reverting the tutorial state keys that can not be saved: %s", ", ".join(sorted(keys)))
+        saved = self._backend.load()
+        for key in keys:
+            if key in saved:
+                self._state[key] = saved[key]
+            else:
+                self._state.pop(key, None)
+
+
+def _saveable(value: Any) -> bool:
+    """Check if a value can be saved by the backends, which store it as JSON."""
+    try:
+        json.dumps(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+_STORES: dict[str, StateStore] = {}
+_STORES_LOCK = threading.Lock()
+
+
+def backend_for(path: str) -> StateBackend:
+    """The backend for a state file, by its suffix."""
+    if Path(path).suffix in (".sqlite", ".db"):
+        return SqliteBackend(path)
+    return JsonFileBackend(path)
+
+
+def get_store(path: str) -> StateStore:
+    """Get the store for a state file, shared by all sessions of this process."""
+    with _STORES_LOCK:
+        store = _STORES.get(path)
+        if store is None:
+            store = _STORES[path] = StateStore(backend_for(path))
+            atexit.register(store.flush)
+        return store
@@ -13,62 +13,140 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Helpers for testing lab steps."""
-import base64
+import asyncio
+import contextvars
 from enum import Enum
 from typing import cast, Any
 
-from common import wb_svc_client
+from common import matching, snapshot, wb_svc_client, wb_svc_files
+from common.snapshot import ProjectSnapshot
 
 
 class TestFail(Exception):
     """Indicates a test failed."""
 
 
-def run_test(fun) -> tuple[bool, None | str, None | Any]:
-    """Cache the state of a test once it passes."""
-    # importing streamlit outside of the toplevel to prevent
-    # nuisance warnings while developing testing code.
-    # pylint: disable-next=import-outside-toplevel
-    import streamlit as st
+def sequential(fun):
+    """Mark a test with side effects, so it is never evaluated ahead of its turn."""
+    fun.sequential = True
+    return fun
 
-    mod_name = fun.__module__.split(".")[-1]
-    idx = mod_name + "_" + fun.__name__
 
-    # recall state from cache, if it exists
-    cached_state = st.session_state.get(idx, None)
-    if cached_state is not None:
-        return cast(tuple[bool, None | str, None | Any], cached_state)
+def requires(*tests):
+    """Declare the tests a test depends on.
 
-    # run the test to evaluate state
-    try:
-        result = fun()
-        state = (True, None, result)
-    except TestFail as exc:
-        state = (False, str(exc), None)
-    else:
-        st.session_state[idx] = state
+    The prerequisites are evaluated first, once per evaluation, and the test fails
+    with the message of the first prerequisite that fails without running."""
+
+    def _declare(fun):
+        fun.requires = tests
+        return fun
+
+    return _declare
+
+
+# the snapshot fields the helpers read, as dotted paths
+BUILD_FIELDS = frozenset(["environment.buildState"])
+RUN_FIELDS = frozenset(["environment.runState"])
+APP_FIELDS = frozenset(["applications.name", "applications.info.runState"])
+COMPOSE_FIELDS = frozenset(["compose.info.runState"])
+PACKAGE_FIELDS = ProjectSnapshot.PACKAGE_FIELDS
+GPU_FIELDS = ProjectSnapshot.GPU_FIELDS
+CHANGES_FIELDS = ProjectSnapshot.CHANGES_FIELDS
 
-    return state
+
+def reads(*fields: str | frozenset[str]):
+    """Declare the snapshot fields a test reads, so only those are queried.
+
+    Fields are dotted paths such as environment.buildState, or sets of them like
+    BUILD_FIELDS. A test that reads no snapshot fields should still be declared with
+    no fields, as the snapshot is fetched whole for tests without a declaration."""
+
+    def _declare(fun):
+        fun.fields = frozenset().union(*[[field] if isinstance(field, str) else field for field in fields])
+        return fun
+
+    return _declare
 
 
 GQLDataType = dict[str, Any]
 
 
-def get_project(project_name: str) -> GQLDataType:
-    """Get a project, fail the test if it doesn't exist.
+def get_project(project_name: str) -> ProjectSnapshot:
+    """Get a snapshot of a project, fail the test if it doesn't exist.
+
+    The snapshot is shared by every test that looks at the project during a rerun
+    and can be passed to the ensure_* helpers.
 
     Error message keys:
       - info_wait_for_project
     """
-    project = wb_svc_client.get_project(project_name)
-    if project is None:
-        raise TestFail("info_wait_for_project")
-    project = project.get("data", {}).get("project", None)
+    return _found(snapshot.get_snapshot(project_name), "info_wait_for_project")
+
+
+async def aget_project(project_name: str) -> ProjectSnapshot:
+    """Get a snapshot of a project, fail the test if it doesn't exist.
+
+    Error message keys:
+      - info_wait_for_project
+    """
+    return _found(await snapshot.aget_snapshot(project_name), "info_wait_for_project")
+
+
+def _found(project: None | ProjectSnapshot, message: str) -> ProjectSnapshot:
+    """Fail the test with message when the project doesn't exist."""
     if project is None:
-        raise TestFail("info_wait_for_project")
+        raise TestFail(message)
     return project
 
 
+def _snapshot(project: str | ProjectSnapshot, message: str) -> ProjectSnapshot:
+    """Use a snapshot as is, or get one by project name failing with message."""
+    if isinstance(project, ProjectSnapshot):
+        return project
+    return _found(snapshot.get_snapshot(project), message)
+
+
+def gather(*lookups) -> list[Any]:
+    """Run independent async lookups concurrently and return their results in order.
+
+    All of the lookups run to completion. If any of them failed, the failure of the
+    earliest lookup in argument order is raised, so put the lookups in the order
+    their messages should take priority."""
+
+    # run the lookups with the caller's context, such as the snapshot fields selected
+    context = contextvars.copy_context()
+
+    async def _gather():
+        loop = asyncio.get_running_loop()
+        tasks = [loop.create_task(lookup, context=context.copy()) for lookup in lookups]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = wb_svc_client.run_async(_gather())
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+def get_projects(project_names: list[str]) -> dict[str, GQLDataType]:
+    """Get several projects in one query, fail the test if any of them doesn't exist.
+
+    Error message keys:
+      - info_wait_for_project
+    """
+    projects = wb_svc_client.get_projects(project_names)
+    if any(project is None for project in projects.values()):
+        raise TestFail("info_wait_for_project")
+    return cast(dict[str, GQLDataType], projects)
+
+
+def find_projects(project_names: list[str], fields: str = wb_svc_client.PROJECT_FIELDS) -> dict[str, GQLDataType]:
+    """Get the projects that exist out of several, using one query."""
+    projects = wb_svc_client.get_projects(project_names, fields)
+    return {name: project for name, project in projects.items() if project is not None}
+
+
 class BuildState(Enum):
     """Possible values for the state of the build."""
 
@@ -123,7 +201,7 @@ class RunState(Enum):
     DEAD = "DEAD"
 
 
-def ensure_run_state(project: GQLDataType, target: RunState):
+def ensure_run_state(project: GQLDataType, target: RunState | list[RunState]):
     """Ensure that a project has desired run state.
 
     Error message keys:
@@ -178,7 +256,7 @@ class AppState(Enum):
     STARTING = "STARTING"
 
 
-def ensure_app_state(app: GQLDataType, target: RunState):
+def ensure_app_state(app: GQLDataType, target: AppState):
     """Ensure application is at desired state.
 
     Error Message Keys:
@@ -204,29 +282,34 @@ def ensure_app_state(app: GQLDataType, target: RunState):
         raise TestFail("info_app_starting")
 
 
-def ensure_package(project_name: str, package_manager: str, package_name: str) -> dict[str, str]:
+def ensure_package(project: str | ProjectSnapshot, package_manager: str, package_name: str) -> dict[str, str]:
     """Ensure package is installed.
 
     Error message keys:
         - info_wait_for_package
     """
-    # pull all package managers
-    packages = wb_svc_client.get_packages(project_name) or {}
-    packages = packages.get("data", {}).get("project", {}).get("environment", {}).get("packageManagers", [])
+    pkg = _snapshot(project, "info_wait_for_package").packages.get(package_manager, {}).get(package_name)
+    if pkg is None:
+        raise TestFail("info_wait_for_package")
+    return pkg
 
-    # find the requested package manager
-    installed_packages = []
-    for manager in packages:
-        if manager["name"] == package_manager:
-            installed_packages = manager["installedPackages"]
-            break
 
-    # find the requested package
-    for pkg in installed_packages:
-        if pkg["name"] == package_name:
-            return pkg
+def ensure_packages(project: str | ProjectSnapshot, packages: dict[str, list[str]]) -> dict[str, list[dict[str, str]]]:
+    """Ensure several packages are installed, given as lists of names by package manager.
 
-    raise TestFail("info_wait_for_package")
+    All packages are checked against one snapshot. Returns the packages in the same shape.
+
+    Error message keys:
+        - info_wait_for_package
+    """
+    index = _snapshot(project, "info_wait_for_package").packages
+    installed: dict[str, list[dict[str, str]]] = {}
+    for manager, names in packages.items():
+        manager_index = index.get(manager, {})
+        installed[manager] = [manager_index[name] for name in names if name in manager_index]
+        if len(installed[manager]) < len(names):
+            raise TestFail("info_wait_for_package")
+    return installed
 
 
 class ComposeState(Enum):
@@ -273,15 +356,73 @@ def ensure_compose_state(project: GQLDataType, target: ComposeState):
 def get_file(project_name: str, directory: str, filename: str) -> bytes:
     """Retrieve a file from a project.
 
+    Unchanged files are served from a decoded copy, only their metadata is queried.
+
+    Error message keys:
+        - info_wait_for_file
+        - info_file_too_large
+    """
+    try:
+        contents = wb_svc_files.read_file(project_name, directory, filename)
+    except wb_svc_files.FileTooLarge:
+        raise TestFail("info_file_too_large")
+    if contents is None:
+        raise TestFail("info_wait_for_file")
+    return contents
+
+
+def ensure_file_contains(project_name: str, directory: str, filename: str, *patterns: bytes):
+    """Ensure a project file contains some patterns.
+
+    The file is streamed and the download stops as soon as every pattern is found.
+    The patterns are found with one scan of the bytes, and the result is kept for
+    as long as the file is unchanged.
+
+    Error message keys:
+        - info_wait_for_file
+        - info_wait_for_code
+        - info_file_too_large
+    """
+    pattern_matcher = matching.matcher(patterns)
+    try:
+        contents = wb_svc_files.read_file(project_name, directory, filename, until=pattern_matcher.until())
+    except wb_svc_files.FileTooLarge:
+        raise TestFail("info_file_too_large")
+    if contents is None:
+        raise TestFail("info_wait_for_file")
+    if pattern_matcher.find(contents) != pattern_matcher.patterns:
+        raise TestFail("info_wait_for_code")
+
+
+async def aget_file(project_name: str, directory: str, filename: str) -> bytes:
+    """Retrieve a file from a project.
+
+    Unchanged files are served from a decoded copy, only their metadata is queried.
+
+    Error message keys:
+        - info_wait_for_file
+    """
+    contents = await wb_svc_files.aread_file(project_name, directory, filename)
+    if contents is None:
+        raise TestFail("info_wait_for_file")
+    return contents
+
+
+def file_exists(project_name: str, directory: str, filename: str) -> dict[str, Any]:
+    """Ensure a file exists in a project, without downloading it.
+
+    Returns the file's metadata.
+
     Error message keys:
         - info_wait_for_file
     """
-    response = wb_svc_client.get_file(project_name, directory, filename) or {}
+    response = wb_svc_files.stat_file(project_name, directory, filename) or {}
     wb_file = response.get("data", {}).get("project", {}).get("file")
     if wb_file is None:
         raise TestFail("info_wait_for_file")
 
-    return base64.b64decode(wb_file["contents"])
+    return wb_file
+
 
 def get_folder(project_name: str, directory: str, folder_name: str) -> dict[str, Any]:
     """Retrieve a folder from a project.
@@ -289,52 +430,33 @@ def get_folder(project_name: str, directory: str, folder_name: str) -> dict[str,
     Error message keys:
         - info_wait_for_folder
     """
-    response = wb_svc_client.get_file(project_name, directory, folder_name) or {}
-    if response is None:
-        raise TestFail("info_wait_for_folder")
-    
+    response = wb_svc_files.stat_file(project_name, directory, folder_name) or {}
     wb_file = response.get("data", {}).get("project", {}).get("file")
     if wb_file is None or not wb_file.get("isDirectory", False):
         raise TestFail("info_wait_for_folder")
-    
+
     return wb_file
 
-def ensure_gpu_count(project_name: str):
+
+def ensure_gpu_count(project: str | ProjectSnapshot):
     """Ensure that a project has a valid GPU count (including 0).
 
     Error message keys:
         - info_wait_for_project
     """
-    response = wb_svc_client.get_gpu_request(project_name) or {}
-    gpu_count = (
-        response.get("data", {})
-                .get("project", {})
-                .get("resources", {})
-                .get("gpusRequested")
-    )
-
+    gpu_count = _snapshot(project, "info_wait_for_project").gpus_requested
     if gpu_count is None:
         raise TestFail("info_wait_for_project")
 
     return gpu_count
 
 
-def ensure_changes_discarded(project_name: str):
+def ensure_changes_discarded(project: str | ProjectSnapshot):
     """Ensure the project has no uncommitted changes.
 
     Error message keys:
         - info_check_changes_discarded
         - info_wait_for_project
     """
-    project = wb_svc_client.get_project(project_name) or {}
-    project = project.get("data", {}).get("project")
-    if project is None:
-        raise TestFail("info_wait_for_project")
-
-    repo_state = project.get("repoState", {})
-    added = repo_state.get("addedFilesCount", 0)
-    modified = repo_state.get("modifiedFilesCount", 0)
-    deleted = repo_state.get("deletedFilesCount", 0)
-
-    if (added + modified + deleted) > 0:
+    if _snapshot(project, "info_wait_for_project").uncommitted_changes > 0:
         raise TestFail("info_check_changes_discarded")
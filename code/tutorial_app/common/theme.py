@@ -15,23 +15,32 @@
 """Common code that is used to render and style boilerplate streamlit objects."""
 
 from dataclasses import dataclass
-import json
+from functools import lru_cache
+import os
 from pathlib import Path
 from types import ModuleType
 from typing import Any
 
-from jinja2 import Environment, BaseLoader
+from jinja2 import Environment, BaseLoader, Template
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from streamlit_autorefresh import st_autorefresh
 from streamlit_extras.stateful_button import button
 
-from common import sidebar, testing
+from common import poller, predicates, runner, session, sidebar, state_store
 
-STATE_FILE = "/project/data/scratch/tutorial_state.json"
+# a .sqlite or .db file keeps the progress in SQLite instead of JSON, see state_store
+STATE_FILE = os.getenv("TUTORIAL_STATE_FILE", "/project/data/scratch/tutorial_state.json")
 STYLESHEETS = [Path(__file__).parent.joinpath("style.css")]
 PREVIOUS = "Previous"
 NEXT = "Next"
 AUTOREFRESH_DELAY = 2500
+# with fragments, how often the pending task checks its test, in seconds
+FRAGMENT_INTERVAL = AUTOREFRESH_DELAY / 1000
+_FRAGMENTS = "theme_fragments_derived"
+# task responses are compiled once by the shared environment, and kept by source
+TEMPLATE_CACHE_SIZE = 256
+_JINJA = Environment(loader=BaseLoader())
 
 
 def ensure_state(key: str, value: Any):
@@ -40,7 +49,7 @@ def ensure_state(key: str, value: Any):
     Prevents unnecessary variable updates."""
     cur_value = st.session_state.get(key, None)
     if cur_value != value:
-        st.session_state[key] = value
+        session.put(key, value)
 
 
 def slugify(name: str) -> str:
@@ -55,36 +64,45 @@ def slugify(name: str) -> str:
 
 
 def load_state():
-    """Load the state from json file."""
+    """Load the saved state into the session."""
     if "_loaded" in st.session_state:
         return
 
-    try:
-        with open(STATE_FILE, "r", encoding="UTF-8") as ptr:
-            loaded_state = json.load(ptr)
-    except (IOError, OSError):
-        loaded_state = {}
-
-    st.session_state.update(loaded_state)
+    st.session_state.update(state_store.get_store(STATE_FILE).load())
     st.session_state["_loaded"] = True
 
 
 def save_state():
-    """Save the session state for all sessions."""
-    # compare states
-    state_dict = st.session_state.to_dict()
-    last_state_json = state_dict.pop("last_state", "{}")  # dont recurse and save last state
-    # dont save autorefresh runtime var
-    # dont save session scoped variables (*_derived)
-    remove_keys = ["autorefresh"] + [key for key in state_dict.keys() if key.endswith("_derived")]
-    _ = [state_dict.pop(key, None) for key in remove_keys]
-    state_json = json.dumps(state_dict)
-
-    # save state when changed
-    if state_json != last_state_json:
-        with open(STATE_FILE, "w", encoding="UTF-8") as ptr:
-            ptr.write(state_json)
-        st.session_state["last_state"] = state_json
+    """Save the keys of the session state that changed, for all sessions.
+
+    Only the keys written since the last save are looked at, so a rerun that
+    changed nothing does no work. The state file is written in the background
+    once the changes settle."""
+    changes = session.take_dirty()
+    if changes:
+        store = state_store.get_store(STATE_FILE)
+        store.update(store.changed(changes))
+
+
+def clear_state():
+    """Forget the saved state."""
+    state_store.get_store(STATE_FILE).clear()
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def _template(source: str) -> Template:
+    """Compile a task response template."""
+    return _JINJA.from_string(source)
+
+
+def _task_test(parent: str, task: dict[str, Any], test_suite: None | ModuleType, messages: dict[str, Any]):
+    """Lookup the test for a task, compiled from its checks or from the test module."""
+    if task.get("check") or task.get("requires"):
+        return predicates.page_tests(parent, messages)[predicates.task_name(task)]
+    test_name = task.get("test", None)
+    if test_name and test_suite is not None:
+        return getattr(test_suite, test_name, None)
+    return None
 
 
 def print_task(parent: str, task: dict[str, str], test_suite: None | ModuleType, messages: dict[str, str]) -> bool:
@@ -95,18 +113,18 @@ def print_task(parent: str, task: dict[str, str], test_suite: None | ModuleType,
     st.write("### " + task.get("name", "name"))
     st.write(task.get("msg", "msg"))
 
-    # Lookup a test from the test module.
-    test = None
-    test_name = task.get("test", None)
-    if test_name and test_suite is not None:
-        test = getattr(test_suite, test_name, None)
+    test = _task_test(parent, task, test_suite, messages)
     result: Any = None
 
     if test:
         # continue task based on test function
         st.write("***")
         st.write("**" + messages.get("testing_msg", "") + "**")
-        success, msg, result = testing.run_test(test)
+        success, msg, result = runner.run_test(test)
+        if not success and st.session_state.get(_FRAGMENTS):
+            # only this task re-runs until its test passes
+            _pending_test(parent, test, test_suite, messages, msg)
+            return False
         if msg is not None:
             st.info(messages.get(msg, msg) or msg)
         if not success:
@@ -119,7 +137,8 @@ def print_task(parent: str, task: dict[str, str], test_suite: None | ModuleType,
         with col1:
             st.write("**" + messages.get("waiting_msg", "") + "**")
         with col2:
-            done = button(messages.get("next"), key=f"{parent}_task_{slug}")
+            with session.tracking(f"{parent}_task_{slug}"):
+                done = button(messages.get("next"), key=f"{parent}_task_{slug}")
         if not done:
             return False
 
@@ -127,12 +146,54 @@ def print_task(parent: str, task: dict[str, str], test_suite: None | ModuleType,
     scs_msg = task.get("response")
     if scs_msg is not None:
         st.write(" ")
-        rtemplate = Environment(loader=BaseLoader).from_string(task.get("response", ""))
-        st.success(rtemplate.render(result=result))
+        st.success(_template(scs_msg).render(result=result))
 
     return True
 
 
+@st.fragment(run_every=FRAGMENT_INTERVAL)
+def _pending_test(parent: str, test, test_suite: None | ModuleType, messages: dict[str, Any], msg: None | str):
+    """Show the message of a pending task's test, checking the test again on every run of the fragment.
+
+    msg is the test's message from the full run of the page. Once the test passes,
+    the page runs again to show the next task."""
+    ctx = get_script_run_ctx()
+    if ctx is not None and ctx.fragment_ids_this_run:
+        # runs of the fragment are never user actions
+        st.session_state["user_action_derived"] = False
+        evaluate_tasks(parent, messages, test_suite)
+        success, msg, _ = runner.run_test(test)
+        if success:
+            st.rerun()
+    if msg is not None:
+        st.info(messages.get(msg, msg) or msg)
+
+
+def evaluate_tasks(parent: str, messages: dict[str, Any], test_suite: None | ModuleType):
+    """Hand the tests for a page's tasks to the background poller and merge their latest states.
+
+    Only the tasks print_task could reach are polled, stopping at a manual task
+    that is not done yet. Tests without a state yet show as pending, so rendering
+    never waits on wb-svc. A user action makes the poller check again right away."""
+    tests = []
+    for task in messages.get("tasks", []):
+        test = _task_test(parent, task, test_suite, messages)
+        if test is None:
+            slug = slugify(task.get("name", "name"))
+            if not st.session_state.get(f"{parent}_task_{slug}"):
+                break
+            continue
+        tests.append(test)
+    if not tests:
+        return
+
+    ctx = get_script_run_ctx()
+    watch_key = f"{ctx.session_id if ctx else ''}/{parent}"
+    pending = runner.pending_tests(tests)
+    states = poller.POLLER.watch(watch_key, pending, acted=st.session_state.get("user_action_derived", True))
+    runner.merge_states(pending, states, missing=runner.PENDING)
+
+
 def print_footer_nav(current: str):
     """Print the footer nav buttons for next and previous excercise."""
     # find the next and previous pages
@@ -173,12 +234,21 @@ class Theme:
 
     autorefresh: bool = True
     ephemeral: bool = False
+    # refresh only the pending task in a fragment, instead of running the whole page again
+    fragments: bool = False
 
     def __enter__(self):
         """Initialize the theme."""
         load_state()
-        if self.autorefresh:
-            st_autorefresh(interval=AUTOREFRESH_DELAY, key="autorefresh")
+        st.session_state[_FRAGMENTS] = self.autorefresh and self.fragments
+        if self.autorefresh and self.fragments:
+            # the page only runs again in full when the user does something
+            st.session_state["user_action_derived"] = True
+        elif self.autorefresh:
+            # reruns that were not triggered by the refresh timer come from the user
+            count = st_autorefresh(interval=AUTOREFRESH_DELAY, key="autorefresh")
+            st.session_state["user_action_derived"] = count == st.session_state.get("autorefresh_count_derived")
+            st.session_state["autorefresh_count_derived"] = count
         load_stylesheet()
 
         with st.sidebar:
@@ -15,169 +15,412 @@
 """This module serves as the client to the graphql unix socket.
 
 The reason this was custom made is because python-gql doesn't support unix sockets.
-Also requests_unixsocket doesn't seem to play nicely with POSTs."""
+Also requests_unixsocket doesn't seem to play nicely with POSTs.
+
+Every helper has an asyncio twin prefixed with an "a" that uses the same
+connection pool settings, so independent lookups can be awaited concurrently.
+
+The helpers run the named queries in wb_svc_queries with GraphQL variables.
+Their responses are cached by query name and variables, using the TTLs in
+CACHE_TTLS, so slow moving data is not refetched on every rerun. Set
+WB_SVC_PERSISTED_QUERIES=1 to send persisted query IDs instead of the full
+query text."""
 
 import json
 import os
+import threading
+import time
 from typing import Any
 
-import requests
-from httpunixsocketconnection import HTTPUnixSocketConnection
+from common import cache, wb_svc_queries, wb_svc_transport
+from common.wb_svc_queries import PROJECT_FIELDS, GQLQuery
+
+PROJECT_INDEX_TTL = 30
+PROJECT_INDEX_MISS_INTERVAL = 1
+RESPONSE_CACHE_SIZE = 256
+PERSISTED_QUERIES = os.getenv("WB_SVC_PERSISTED_QUERIES", "0") == "1"
+
+# seconds a response stays fresh for each helper, 0 disables caching
+CACHE_TTLS: dict[str, float] = {
+    "project": 0,
+    # shorter than the autorefresh interval, so each rerun shares one snapshot
+    "snapshot": 2,
+    "projects": 0,
+    "file": 0,
+    "packages": 30,
+    "gpu_request": 5,
+}
+
+_RESPONSE_CACHE = cache.TTLCache(RESPONSE_CACHE_SIZE)
+# the server answers with these errors when it does not know a persisted query
+_PERSISTED_NOT_FOUND = b"PersistedQueryNotFound"
+_PERSISTED_NOT_SUPPORTED = b"PersistedQueryNotSupported"
+
+
+def _cached(key: str) -> None | dict[str, Any]:
+    """Get a cached response."""
+    body = _RESPONSE_CACHE.get(key)
+    if body is None:
+        return None
+    return json.loads(body)
+
+
+def _decode(key: str, body: bytes, ttl: float) -> dict[str, Any]:
+    """Decode a response and cache it when it was successful."""
+    response = json.loads(body)
+    if ttl > 0 and not response.get("errors"):
+        _RESPONSE_CACHE.set(key, body, ttl)
+    return response
+
+
+def _payloads(gql_query: GQLQuery, variables: None | dict[str, Any]) -> list[str]:
+    """The request bodies to try in order for a registered query.
+
+    With persisted queries, only the ID is sent at first. If the server does not
+    know the ID yet, the full document is sent along with it so the server can
+    store it."""
+    payload: dict[str, Any] = {"operationName": gql_query.name, "variables": variables or {}}
+    if not PERSISTED_QUERIES:
+        return [json.dumps({"query": gql_query.document, **payload})]
+    payload["extensions"] = {"persistedQuery": {"version": 1, "sha256Hash": gql_query.sha256}}
+    return [json.dumps(payload), json.dumps({"query": gql_query.document, **payload})]
+
+
+def request_body(name: str, variables: None | dict[str, Any] = None) -> str:
+    """The JSON request body for a registered query, including its full document."""
+    gql_query = wb_svc_queries.get(name)
+    return json.dumps({"query": gql_query.document, "operationName": name, "variables": variables or {}})
+
+
+def _persisted_miss(body: bytes) -> bool:
+    """Check if a persisted query must be resent with its document."""
+    global PERSISTED_QUERIES  # pylint: disable=global-statement
+    if _PERSISTED_NOT_SUPPORTED in body:
+        PERSISTED_QUERIES = False
+        return True
+    return _PERSISTED_NOT_FOUND in body
+
+
+def execute(name: str | GQLQuery, variables: None | dict[str, Any] = None, ttl: float = 0) -> dict[str, Any]:
+    """Run a registered query with variables.
+
+    The response is cached for ttl seconds when a ttl is given."""
+    gql_query = name if isinstance(name, GQLQuery) else wb_svc_queries.get(name)
+    key = gql_query.cache_key(variables)
+    if ttl > 0 and (response := _cached(key)) is not None:
+        return response
+
+    payloads = _payloads(gql_query, variables)
+    body = wb_svc_transport.post(payloads[0])
+    if len(payloads) > 1 and _persisted_miss(body):
+        body = wb_svc_transport.post(payloads[1])
+    return _decode(key, body, ttl)
+
+
+async def aexecute(name: str | GQLQuery, variables: None | dict[str, Any] = None, ttl: float = 0) -> dict[str, Any]:
+    """Run a registered query with variables from a coroutine.
+
+    The response is cached for ttl seconds when a ttl is given."""
+    gql_query = name if isinstance(name, GQLQuery) else wb_svc_queries.get(name)
+    key = gql_query.cache_key(variables)
+    if ttl > 0 and (response := _cached(key)) is not None:
+        return response
+
+    payloads = _payloads(gql_query, variables)
+    body = await wb_svc_transport.apost(payloads[0])
+    if len(payloads) > 1 and _persisted_miss(body):
+        body = await wb_svc_transport.apost(payloads[1])
+    return _decode(key, body, ttl)
+
+
+def query(query_str: str, ttl: float = 0):
+    """Send a GraphQL query over a Unix socket.
+
+    Prefer registering the query in wb_svc_queries and using execute. The response
+    is cached for ttl seconds when a ttl is given."""
+    key = " ".join(query_str.split())
+    if ttl > 0 and (response := _cached(key)) is not None:
+        return response
+    body = wb_svc_transport.post(json.dumps({"query": query_str}))
+    return _decode(key, body, ttl)  # type: ignore
+
 
-GQL_SOCKET = "/wb-svc-ro.socket"
-QUERY_TIMEOUT = 3
+async def aquery(query_str: str, ttl: float = 0):
+    """Send a GraphQL query over a Unix socket from a coroutine.
 
+    Prefer registering the query in wb_svc_queries and using aexecute. The response
+    is cached for ttl seconds when a ttl is given."""
+    key = " ".join(query_str.split())
+    if ttl > 0 and (response := _cached(key)) is not None:
+        return response
+    body = await wb_svc_transport.apost(json.dumps({"query": query_str}))
+    return _decode(key, body, ttl)  # type: ignore
 
-def query(query_str: str):
-    """Send a GraphQL query over a Unix socket."""
-    api_host = os.getenv("NVWB_API")
-    if api_host:
-        req = requests.post(
-            f"http://{api_host}/v1/query",
-            json={"query": query_str},
-            headers={"Content-Type": "application/json"},
-        )
-        return req.json()
 
+def invalidate_cache(contains: None | str = None):
+    """Drop cached responses whose key contains a string, or all cached responses.
+
+    Keys are the query name followed by the JSON encoded variables."""
+    if contains is None:
+        _RESPONSE_CACHE.invalidate()
     else:
-        conn = HTTPUnixSocketConnection(unix_socket=GQL_SOCKET, timeout=QUERY_TIMEOUT)
-        request_data = json.dumps({"query": query_str})
-        conn.request("POST", "/v1/query", body=request_data, headers={"Content-Type": "application/json"})
-        response = conn.getresponse()
-        body = response.read().decode("UTF-8")
-        return json.loads(body)  # type: ignore
+        _RESPONSE_CACHE.invalidate(lambda key: contains in key)
+
+
+def cache_stats() -> cache.CacheStats:
+    """Get the hit and miss counters of the response cache."""
+    return _RESPONSE_CACHE.stats
+
+
+def single_flight_stats() -> wb_svc_transport.SingleFlightStats:
+    """Get how many wb-svc requests were made and how many were collapsed into an in-flight one."""
+    return wb_svc_transport.single_flight_stats()
+
+
+def run_async(coro):
+    """Run a coroutine from blocking code, using the shared client loop."""
+    return wb_svc_transport.run(coro)
 
 
 def list_projects() -> dict[str, Any]:
     """List the projects and return the name, id, and path."""
-    return query(
-        """query {
-            projects {
-                edges {
-                    node {
-                        name
-                        id
-                        path
-                    }
-                }
-            }
-        }"""
-    )
+    return execute("ListProjects")
+
+
+async def alist_projects() -> dict[str, Any]:
+    """List the projects and return the name, id, and path."""
+    return await aexecute("ListProjects")
+
+
+class _ProjectIndex:
+    """A process wide index of project names to project paths.
+
+    The index is rebuilt from list_projects when it is older than the TTL or when
+    a lookup misses. Misses only rebuild once per interval so that polling for a
+    project that does not exist does not multiply the list queries."""
+
+    def __init__(self, ttl: float, miss_interval: float):
+        """Initialize an empty index."""
+        self._ttl = ttl
+        self._miss_interval = miss_interval
+        self._lock = threading.Lock()
+        self._paths: dict[str, str] = {}
+        self._built_at: None | float = None
+
+    def _age(self) -> float:
+        """Seconds since the index was built."""
+        if self._built_at is None:
+            return float("inf")
+        return time.monotonic() - self._built_at
+
+    def needs_rebuild(self, project_name: str) -> bool:
+        """Check if the project list must be fetched before looking up a project."""
+        if self._age() > self._ttl:
+            return True
+        return project_name not in self._paths and self._age() > self._miss_interval
+
+    def rebuild(self, response: dict[str, Any]):
+        """Rebuild the index from a list_projects response."""
+        projects = response["data"]["projects"]["edges"]
+        self._paths = {project["node"]["name"]: project["node"]["path"] for project in projects}
+        self._built_at = time.monotonic()
+
+    def lookup(self, project_name: str) -> None | str:
+        """Find a project's path."""
+        with self._lock:
+            if self.needs_rebuild(project_name):
+                self.rebuild(list_projects())
+            return self._paths.get(project_name)
+
+    async def alookup(self, project_name: str) -> None | str:
+        """Find a project's path from a coroutine."""
+        if self.needs_rebuild(project_name):
+            self.rebuild(await alist_projects())
+        return self._paths.get(project_name)
+
+    def invalidate(self, project_name: None | str = None) -> list[str]:
+        """Drop a project from the index or clear the whole index. Returns the dropped paths."""
+        with self._lock:
+            if project_name is None:
+                dropped = list(self._paths.values())
+                self._paths = {}
+                self._built_at = None
+                return dropped
+            path = self._paths.pop(project_name, None)
+            if path is None:
+                return []
+            # force the next lookup to see the current project list
+            self._built_at = None
+            return [path]
+
+
+_PROJECT_INDEX = _ProjectIndex(PROJECT_INDEX_TTL, PROJECT_INDEX_MISS_INTERVAL)
 
 
 def get_project_path(project_name: str) -> None | str:
     """Find the project path."""
-    projects = list_projects()["data"]["projects"]["edges"]
-    for project in projects:
-        if project["node"]["name"] == project_name:
-            return project["node"]["path"]
-    return None
+    return _PROJECT_INDEX.lookup(project_name)
 
 
-def get_project(project_name: str) -> None | dict[str, Any]:
-    """Get a project's details."""
+async def aget_project_path(project_name: str) -> None | str:
+    """Find the project path."""
+    return await _PROJECT_INDEX.alookup(project_name)
+
+
+def invalidate_project_path(project_name: None | str = None):
+    """Forget the cached path of a project, or of all projects when no name is given.
+
+    Cached responses for the forgotten projects are dropped as well."""
+    for project_path in _PROJECT_INDEX.invalidate(project_name):
+        invalidate_cache(wb_svc_queries.project_key(project_path))
+
+
+def _project_found(project_name: str, response: dict[str, Any]) -> bool:
+    """Check a project query response, dropping the stale index entry when it came back empty.
+
+    A response with errors may be empty for another reason, so it keeps the entry."""
+    if (response.get("data") or {}).get("project") is not None:
+        return True
+    if not response.get("errors"):
+        invalidate_project_path(project_name)
+    return False
+
+
+def query_project(
+    project_name: str, name: str, variables: None | dict[str, Any] = None, ttl: float = 0
+) -> None | dict[str, Any]:
+    """Run a registered query that takes the project's path as $projectPath.
+
+    Returns None when the project does not exist."""
     project_path = get_project_path(project_name)
     if project_path is None:
         return None
 
-    return query(
-        f"""query {{
-                project(projectPath: "{project_path}") {{
-                    name
-                    path
-                    remoteUrl
-                    hasCompose
-                    compose {{
-                        fileLocation
-                        availableProfiles
-                        info {{
-                            enabledProfiles
-                            runState
-                        }}
-                    }}
-                    gitBranches {{
-                        name
-                    }}
-                    repoState {{
-                        commitsAhead
-                        commitsBehind
-                        addedFilesCount
-                        modifiedFilesCount
-                        deletedFilesCount
-                        changes {{
-                            file
-                            fileStatus
-                        }}
-                    }}
-                    environment {{
-                        buildState
-                        runState
-                        id
-                    }}
-                    applications {{
-                        name
-                        info {{
-                            runState
-                            url
-                        }}
-                    }}
-                }}
-            }}"""
-    )
-
-
-def get_file(project_name: str, relative_path: str, filename: str) -> dict[str, Any]:
-    """Find a file in the project."""
-    project_path = get_project_path(project_name)
+    response = execute(name, {"projectPath": project_path, **(variables or {})}, ttl)
+    if _project_found(project_name, response):
+        return response
+    return None
+
+
+async def aquery_project(
+    project_name: str, name: str, variables: None | dict[str, Any] = None, ttl: float = 0
+) -> None | dict[str, Any]:
+    """Run a registered query that takes the project's path as $projectPath.
+
+    Returns None when the project does not exist."""
+    project_path = await aget_project_path(project_name)
     if project_path is None:
         return None
 
-    return query(
-        f"""query {{
-            project(projectPath: "{project_path}") {{
-                file(relativePath: "{relative_path}", fileName: "{filename}") {{
-                    contents
-                    modifiedAt
-                    isDirectory
-                }}
-            }}
-        }}"""
-    )
+    response = await aexecute(name, {"projectPath": project_path, **(variables or {})}, ttl)
+    if _project_found(project_name, response):
+        return response
+    return None
+
+
+def get_project(project_name: str) -> None | dict[str, Any]:
+    """Get a project's details."""
+    return query_project(project_name, "Project", ttl=CACHE_TTLS["project"])
+
+
+async def aget_project(project_name: str) -> None | dict[str, Any]:
+    """Get a project's details."""
+    return await aquery_project(project_name, "Project", ttl=CACHE_TTLS["project"])
+
+
+def _snapshot_query(fields: None | frozenset[str]) -> str:
+    """The name of the query for a snapshot of some fields, or of all of them."""
+    return "ProjectSnapshot" if fields is None else wb_svc_queries.project_query(fields).name
+
+
+def get_snapshot(project_name: str, fields: None | frozenset[str] = None) -> None | dict[str, Any]:
+    """Get a project's details, packages and resources with one query.
+
+    Pass fields as dotted paths to only select those."""
+    return query_project(project_name, _snapshot_query(fields), ttl=CACHE_TTLS["snapshot"])
+
+
+async def aget_snapshot(project_name: str, fields: None | frozenset[str] = None) -> None | dict[str, Any]:
+    """Get a project's details, packages and resources with one query.
+
+    Pass fields as dotted paths to only select those."""
+    return await aquery_project(project_name, _snapshot_query(fields), ttl=CACHE_TTLS["snapshot"])
 
 
-def get_packages(project_name: str) -> dict[str, Any]:
+def _unpack_projects(
+    project_names: list[str], aliases: dict[str, str], response: dict[str, Any]
+) -> dict[str, None | dict[str, Any]]:
+    """Map an aliased projects response back to the project names.
+
+    The index entries of the projects that came back empty are dropped, unless the
+    response has errors, which may leave a project empty for another reason."""
+    projects: dict[str, None | dict[str, Any]] = {name: None for name in project_names}
+    data = response.get("data") or {}
+    for alias, name in aliases.items():
+        projects[name] = data.get(alias)
+        if projects[name] is None and not response.get("errors"):
+            invalidate_project_path(name)
+    return projects
+
+
+def get_projects(project_names: list[str], fields: str = PROJECT_FIELDS) -> dict[str, None | dict[str, Any]]:
+    """Get the details of several projects with a single aliased query.
+
+    Returns the project data keyed by name. Projects that do not exist map to None."""
+    paths = {name: get_project_path(name) for name in project_names}
+    existing = [name for name in project_names if paths[name] is not None]
+    aliases = {f"p{idx}": name for idx, name in enumerate(existing)}
+    if not aliases:
+        return {name: None for name in project_names}
+
+    gql_query = wb_svc_queries.projects_query(len(aliases), fields)
+    response = execute(gql_query, {alias: paths[name] for alias, name in aliases.items()}, CACHE_TTLS["projects"])
+    return _unpack_projects(project_names, aliases, response)
+
+
+async def aget_projects(project_names: list[str], fields: str = PROJECT_FIELDS) -> dict[str, None | dict[str, Any]]:
+    """Get the details of several projects with a single aliased query.
+
+    Returns the project data keyed by name. Projects that do not exist map to None."""
+    paths = {name: await aget_project_path(name) for name in project_names}
+    existing = [name for name in project_names if paths[name] is not None]
+    aliases = {f"p{idx}": name for idx, name in enumerate(existing)}
+    if not aliases:
+        return {name: None for name in project_names}
+
+    gql_query = wb_svc_queries.projects_query(len(aliases), fields)
+    variables = {alias: paths[name] for alias, name in aliases.items()}
+    response = await aexecute(gql_query, variables, CACHE_TTLS["projects"])
+    return _unpack_projects(project_names, aliases, response)
+
+
+def get_file(project_name: str, relative_path: str, filename: str) -> None | dict[str, Any]:
+    """Find a file in the project."""
+    variables = {"relativePath": relative_path, "fileName": filename}
+    return query_project(project_name, "File", variables, CACHE_TTLS["file"])
+
+
+async def aget_file(project_name: str, relative_path: str, filename: str) -> None | dict[str, Any]:
+    """Find a file in the project."""
+    variables = {"relativePath": relative_path, "fileName": filename}
+    return await aquery_project(project_name, "File", variables, CACHE_TTLS["file"])
+
+
+def get_packages(project_name: str) -> None | dict[str, Any]:
     """List the packages installed in a project."""
-    project_path = get_project_path(project_name)
-    if project_path is None:
-        return None
-    return query(
-        f"""query {{
-            project(projectPath: "{project_path}") {{
-                    environment {{
-                        packageManagers {{
-                            name
-                            installedPackages {{
-                                name
-                            }}
-                        }}
-                    }}
-                }}
-            }}"""
-    )
+    return query_project(project_name, "Packages", ttl=CACHE_TTLS["packages"])
+
+
+async def aget_packages(project_name: str) -> None | dict[str, Any]:
+    """List the packages installed in a project."""
+    return await aquery_project(project_name, "Packages", ttl=CACHE_TTLS["packages"])
 
 
 def get_gpu_request(project_name: str) -> dict[str, Any] | None:
     """Query project for GPU assignment."""
-    project_path = get_project_path(project_name)
-    if project_path is None:
-        return None
+    return query_project(project_name, "GpuRequest", ttl=CACHE_TTLS["gpu_request"])
+
 
-    return query(
-        f"""query {{
-            project(projectPath: "{project_path}") {{
-                resources {{
-                    gpusRequested
-                }}
-            }}
-        }}"""
-    )
+async def aget_gpu_request(project_name: str) -> dict[str, Any] | None:
+    """Query project for GPU assignment."""
+    return await aquery_project(project_name, "GpuRequest", ttl=CACHE_TTLS["gpu_request"])
@@ -0,0 +1,262 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""File helpers for the wb-svc client.
+
+File contents are the largest thing the tests download. These helpers avoid
+that when they can: stat_file only asks for metadata, and read_file keeps the
+decoded contents and reuses them while the file's modifiedAt is unchanged.
+
+read_file also streams the response: the base64 contents are decoded chunk by
+chunk as they arrive, so the JSON text and the base64 string are never held in
+memory. Streaming enforces MAX_FILE_SIZE and can stop as soon as a predicate
+on the decoded bytes is satisfied."""
+
+import base64
+import binascii
+from collections.abc import Callable
+from dataclasses import dataclass
+import json
+from typing import Any
+
+from common import cache, wb_svc_client, wb_svc_transport
+
+FILE_CACHE_BYTES = 32 * 1024 * 1024
+MAX_FILE_SIZE = 64 * 1024 * 1024
+
+# called with the decoded bytes so far and the offset of the newly decoded bytes
+StopPredicate = Callable[[bytearray, int], bool]
+
+
+class FileTooLarge(Exception):
+    """Indicates a file is larger than the allowed maximum size."""
+
+
+_FILE_CACHE = cache.SizedLRUCache(FILE_CACHE_BYTES)
+
+
+def stat_file(project_name: str, relative_path: str, filename: str) -> None | dict[str, Any]:
+    """Find a file or folder in the project without downloading its contents, None if the project doesn't exist."""
+    variables = {"relativePath": relative_path, "fileName": filename}
+    return wb_svc_client.query_project(project_name, "FileStat", variables, wb_svc_client.CACHE_TTLS["file"])
+
+
+async def astat_file(project_name: str, relative_path: str, filename: str) -> None | dict[str, Any]:
+    """Find a file or folder in the project without downloading its contents, None if the project doesn't exist."""
+    variables = {"relativePath": relative_path, "fileName": filename}
+    return await wb_svc_client.aquery_project(project_name, "FileStat", variables, wb_svc_client.CACHE_TTLS["file"])
+
+
+def _file_node(response: None | dict[str, Any]) -> None | dict[str, Any]:
+    """Pull the file out of a file query response."""
+    return (((response or {}).get("data") or {}).get("project") or {}).get("file")
+
+
+def _decode_file(key: tuple[str, str, str], response: None | dict[str, Any]) -> None | bytes:
+    """Decode a file query response and keep the decoded contents for later reads."""
+    wb_file = _file_node(response)
+    if wb_file is None or wb_file.get("contents") is None:
+        _FILE_CACHE.invalidate(key)
+        return None
+    contents = base64.b64decode(wb_file["contents"])
+    if wb_file.get("modifiedAt") is not None:
+        _FILE_CACHE.set(key, wb_file["modifiedAt"], contents)
+    return contents
+
+
+class _ContentsDecoder:
+    """Incrementally pull the base64 contents out of a streamed file query response.
+
+    The rest of the response is kept, with the contents blanked out, so it can be
+    parsed as JSON once the stream ends."""
+
+    _MARKER = b'"contents":'
+
+    def __init__(self, max_size: int, until: None | StopPredicate):
+        """Initialize the decoder before the first chunk."""
+        self.contents = bytearray()
+        self.rest = bytearray()
+        self.matched = False
+        self.has_contents = False
+        self._max_size = max_size
+        self._until = until
+        self._state = "search"
+        self._carry = b""
+        self._pending = b""
+
+    def _decode(self, encoded: bytes, final: bool = False):
+        """Decode whole base64 quanta, keeping any remainder for the next chunk."""
+        # base64 has no backslashes, so any backslash is a JSON escape such as \/
+        encoded = self._pending + encoded.replace(b"\\", b"")
+        usable = len(encoded) if final else len(encoded) - len(encoded) % 4
+        self._pending = encoded[usable:]
+        new_start = len(self.contents)
+        self.contents.extend(binascii.a2b_base64(encoded[:usable]))
+        if len(self.contents) > self._max_size:
+            raise FileTooLarge(f"File is larger than {self._max_size} bytes.")
+        if self._until is not None and len(self.contents) > new_start:
+            self.matched = self._until(self.contents, new_start)
+
+    def feed(self, chunk: bytes) -> bool:
+        """Process the next chunk of the response. Returns True when reading can stop."""
+        data = self._carry + chunk
+        self._carry = b""
+        if self._state == "search":
+            idx = data.find(self._MARKER)
+            if idx == -1:
+                keep = len(self._MARKER) - 1
+                self.rest.extend(data[:-keep])
+                self._carry = data[-keep:]
+                return False
+            self.rest.extend(data[: idx + len(self._MARKER)])
+            data = data[idx + len(self._MARKER) :]
+            self._state = "value"
+
+        if self._state == "value":
+            data = data.lstrip()
+            if not data:
+                return False
+            if data[:1] != b'"':
+                # the contents are null
+                self._state = "done"
+            else:
+                self.rest.extend(b'""')
+                data = data[1:]
+                self.has_contents = True
+                self._state = "string"
+
+        if self._state == "string":
+            end = data.find(b'"')
+            self._decode(data if end == -1 else data[:end], final=end != -1)
+            if end == -1:
+                return self.matched
+            data = data[end + 1 :]
+            self._state = "done"
+
+        self.rest.extend(data)
+        return self.matched
+
+    @property
+    def complete(self) -> bool:
+        """Check if all of the contents were decoded."""
+        return self._state == "done"
+
+    def finish(self) -> bytes:
+        """End the stream and return the rest of the response."""
+        self.rest.extend(self._carry)
+        self._carry = b""
+        return bytes(self.rest)
+
+
+@dataclass
+class StreamedFile:
+    """A file read by streaming its contents."""
+
+    contents: bytearray
+    modified_at: None | str = None
+    matched: bool = False
+    complete: bool = True
+
+
+def stream_file(
+    project_name: str,
+    relative_path: str,
+    filename: str,
+    max_size: int = MAX_FILE_SIZE,
+    until: None | StopPredicate = None,
+) -> None | StreamedFile:
+    """Stream a file from the project, decoding its contents as they arrive.
+
+    Reading stops early once until is satisfied, in which case matched is set and
+    the contents are partial unless complete is set. Raises FileTooLarge when the
+    file exceeds max_size."""
+    project_path = wb_svc_client.get_project_path(project_name)
+    if project_path is None:
+        return None
+
+    variables = {"projectPath": project_path, "relativePath": relative_path, "fileName": filename}
+    decoder = _ContentsDecoder(max_size, until)
+    with wb_svc_transport.stream(wb_svc_client.request_body("File", variables)) as chunks:
+        for chunk in chunks:
+            if decoder.feed(chunk):
+                return StreamedFile(decoder.contents, matched=True, complete=decoder.complete)
+
+    response = json.loads(decoder.finish())
+    if (response.get("data") or {}).get("project") is None:
+        wb_svc_client.invalidate_project_path(project_name)
+    wb_file = _file_node(response)
+    if wb_file is None or not decoder.has_contents:
+        return None
+    return StreamedFile(decoder.contents, wb_file.get("modifiedAt"))
+
+
+def read_file(
+    project_name: str,
+    relative_path: str,
+    filename: str,
+    until: None | StopPredicate = None,
+    modified_at: None | str = None,
+) -> None | bytes:
+    """Read and decode a file from the project.
+
+    When a decoded copy is cached, only the file's metadata is queried and the copy
+    is reused as long as the file was not modified. Callers that already know the
+    file's modifiedAt can pass it to skip that query. Otherwise the file is streamed.
+    If until is satisfied before the whole file was read, the partial contents are
+    returned and not cached. Contents that were read whole before until was
+    satisfied are cached when modified_at was passed."""
+    key = (project_name, relative_path, filename)
+    if modified_at is not None and (contents := _FILE_CACHE.get(key, modified_at)) is not None:
+        return contents
+    if modified_at is None and _FILE_CACHE.peek_tag(key) is not None:
+        wb_file = _file_node(stat_file(project_name, relative_path, filename))
+        if wb_file is None:
+            _FILE_CACHE.invalidate(key)
+            return None
+        contents = _FILE_CACHE.get(key, wb_file.get("modifiedAt"))
+        if contents is not None:
+            return contents
+
+    streamed = stream_file(project_name, relative_path, filename, until=until)
+    if streamed is None:
+        _FILE_CACHE.invalidate(key)
+        return None
+    contents = bytes(streamed.contents)
+    tag = modified_at if streamed.matched else streamed.modified_at
+    if streamed.complete and tag is not None:
+        _FILE_CACHE.set(key, tag, contents)
+    return contents
+
+
+async def aread_file(project_name: str, relative_path: str, filename: str) -> None | bytes:
+    """Read and decode a file from the project.
+
+    When a decoded copy is cached, only the file's metadata is queried and the copy
+    is reused as long as the file was not modified."""
+    key = (project_name, relative_path, filename)
+    if _FILE_CACHE.peek_tag(key) is not None:
+        wb_file = _file_node(await astat_file(project_name, relative_path, filename))
+        if wb_file is None:
+            _FILE_CACHE.invalidate(key)
+            return None
+        contents = _FILE_CACHE.get(key, wb_file.get("modifiedAt"))
+        if contents is not None:
+            return contents
+
+    return _decode_file(key, await wb_svc_client.aget_file(project_name, relative_path, filename))
+
+
+def file_cache_stats() -> cache.CacheStats:
+    """Get the hit and miss counters of the decoded file cache."""
+    return _FILE_CACHE.stats
@@ -0,0 +1,277 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Registry of the GraphQL queries sent to wb-svc.
+
+Every query is named and takes its inputs as GraphQL variables, so the document
+text never changes between calls. The server only ever sees a handful of
+documents, and responses can be cached by query name and variables. Each query
+also has a SHA-256 ID, which lets the client send persisted queries."""
+
+from dataclasses import dataclass
+from functools import cached_property, lru_cache
+import hashlib
+import json
+from typing import Any
+
+PROJECT_FIELDS = """
+    name
+    path
+    remoteUrl
+    hasCompose
+    compose {
+        fileLocation
+        availableProfiles
+        info {
+            enabledProfiles
+            runState
+        }
+    }
+    gitBranches {
+        name
+    }
+    repoState {
+        commitsAhead
+        commitsBehind
+        addedFilesCount
+        modifiedFilesCount
+        deletedFilesCount
+        changes {
+            file
+            fileStatus
+        }
+    }
+    environment {
+        buildState
+        runState
+        id
+    }
+    applications {
+        name
+        info {
+            runState
+            url
+        }
+    }
+"""
+
+# everything the lab tests look at, fetched together in one round trip
+SNAPSHOT_FIELDS = f"""
+    {PROJECT_FIELDS}
+    environment {{
+        packageManagers {{
+            name
+            installedPackages {{
+                name
+            }}
+        }}
+    }}
+    resources {{
+        gpusRequested
+    }}
+"""
+
+
+@dataclass(frozen=True)
+class GQLQuery:
+    """A named GraphQL document that takes its inputs as variables."""
+
+    name: str
+    document: str
+
+    @cached_property
+    def sha256(self) -> str:
+        """The persisted query ID of the document."""
+        return hashlib.sha256(self.document.encode("UTF-8")).hexdigest()
+
+    def cache_key(self, variables: None | dict[str, Any]) -> str:
+        """A key that identifies this query with a set of variables."""
+        return f"{self.name} {json.dumps(variables or {}, sort_keys=True)}"
+
+
+QUERIES: dict[str, GQLQuery] = {}
+
+
+def register(name: str, document: str) -> GQLQuery:
+    """Add a query to the registry."""
+    gql_query = QUERIES[name] = GQLQuery(name, " ".join(document.split()))
+    return gql_query
+
+
+def get(name: str) -> GQLQuery:
+    """Look up a registered query by name."""
+    return QUERIES[name]
+
+
+def _digest(text: str) -> str:
+    """A short digest to tell generated documents apart."""
+    return hashlib.sha256(text.encode("UTF-8")).hexdigest()[:8]
+
+
+def selection(fields: frozenset[str]) -> str:
+    """Render fields, given as dotted paths such as environment.buildState, as a GraphQL selection set."""
+    tree: dict[str, dict] = {}
+    for path in sorted(fields):
+        node = tree
+        for part in path.split("."):
+            node = node.setdefault(part, {})
+
+    def _render(node: dict[str, dict]) -> str:
+        return " ".join(f"{key} {{ {_render(child)} }}" if child else key for key, child in node.items())
+
+    return _render(tree)
+
+
+def project_key(project_path: str) -> str:
+    """The part of a cache key that identifies a project."""
+    return json.dumps({"projectPath": project_path})[1:-1]
+
+
+register(
+    "ListProjects",
+    """query ListProjects {
+        projects {
+            edges {
+                node {
+                    name
+                    id
+                    path
+                }
+            }
+        }
+    }""",
+)
+
+register(
+    "Project",
+    f"""query Project($projectPath: String!) {{
+        project(projectPath: $projectPath) {{
+            {PROJECT_FIELDS}
+        }}
+    }}""",
+)
+
+register(
+    "ProjectSnapshot",
+    f"""query ProjectSnapshot($projectPath: String!) {{
+        project(projectPath: $projectPath) {{
+            {SNAPSHOT_FIELDS}
+        }}
+    }}""",
+)
+
+register(
+    "File",
+    """query File($projectPath: String!, $relativePath: String!, $fileName: String!) {
+        project(projectPath: $projectPath) {
+            file(relativePath: $relativePath, fileName: $fileName) {
+                contents
+                modifiedAt
+                isDirectory
+            }
+        }
+    }""",
+)
+
+register(
+    "FileStat",
+    """query FileStat($projectPath: String!, $relativePath: String!, $fileName: String!) {
+        project(projectPath: $projectPath) {
+            file(relativePath: $relativePath, fileName: $fileName) {
+                modifiedAt
+                isDirectory
+            }
+        }
+    }""",
+)
+
+register(
+    "Packages",
+    """query Packages($projectPath: String!) {
+        project(projectPath: $projectPath) {
+            environment {
+                packageManagers {
+                    name
+                    installedPackages {
+                        name
+                    }
+                }
+            }
+        }
+    }""",
+)
+
+register(
+    "GpuRequest",
+    """query GpuRequest($projectPath: String!) {
+        project(projectPath: $projectPath) {
+            resources {
+                gpusRequested
+            }
+        }
+    }""",
+)
+
+
+@lru_cache(maxsize=32)
+def projects_query(count: int, fields: str = PROJECT_FIELDS) -> GQLQuery:
+    """Get the aliased query for count projects, registering it on first use.
+
+    The projects are passed as the variables p0 to p(count-1), and their data is
+    returned under the same aliases."""
+    name = f"Projects{count}_{_digest(fields)}"
+    arguments = ", ".join(f"$p{idx}: String!" for idx in range(count))
+    selections = " ".join(f"p{idx}: project(projectPath: $p{idx}) {{ {fields} }}" for idx in range(count))
+    return register(name, f"query {name}({arguments}) {{ {selections} }}")
+
+
+@lru_cache(maxsize=64)
+def project_query(fields: frozenset[str]) -> GQLQuery:
+    """Get a project query that selects only some fields, registering it on first use.
+
+    The fields are dotted paths, the project's name is always selected."""
+    selected = selection(fields | {"name"})
+    name = f"ProjectFields_{_digest(selected)}"
+    return register(
+        name,
+        f"""query {name}($projectPath: String!) {{
+            project(projectPath: $projectPath) {{ {selected} }}
+        }}""",
+    )
+
+
+@lru_cache(maxsize=64)
+def page_query(file_count: int, fields: None | frozenset[str] = None) -> GQLQuery:
+    """Get the snapshot query extended with the metadata of file_count files, registering it on first use.
+
+    The files are passed as the variables r0/n0 to r(count-1)/n(count-1), for the
+    relative path and file name, and their metadata is returned under the aliases
+    f0 to f(count-1). When fields are given, only they are selected instead of
+    the whole snapshot."""
+    selected = SNAPSHOT_FIELDS if fields is None else selection(fields | {"name"})
+    name = f"PageSnapshot{file_count}_{_digest(selected)}"
+    arguments = "".join(f", $r{idx}: String!, $n{idx}: String!" for idx in range(file_count))
+    files = " ".join(
+        f"f{idx}: file(relativePath: $r{idx}, fileName: $n{idx}) {{ modifiedAt isDirectory }}"
+        for idx in range(file_count)
+    )
+    return register(
+        name,
+        f"""query {name}($projectPath: String!{arguments}) {{
+            project(projectPath: $projectPath) {{
+                {selected}
+                {files}
+            }}
+        }}""",
+    )
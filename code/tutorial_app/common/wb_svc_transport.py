@@ -0,0 +1,462 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Pooled transports to the wb-svc GraphQL endpoint.
+
+wb-svc is reached over the read only unix socket or, when NVWB_API is set, over TCP.
+Both a blocking and an asyncio transport are provided. They share the pool settings
+and the blocking helpers can drive the asyncio transport on a shared client loop,
+so pooled connections survive between streamlit reruns.
+
+Identical requests that are in flight at the same time, from any session or
+thread, are collapsed into one request whose response is shared."""
+
+import asyncio
+from collections.abc import Callable, Coroutine, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from functools import partial
+import http.client
+import os
+import select
+import threading
+import time
+from typing import Any, TypeVar
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from httpunixsocketconnection import HTTPUnixSocketConnection
+
+GQL_SOCKET = "/wb-svc-ro.socket"
+GQL_PATH = "/v1/query"
+QUERY_TIMEOUT = 3
+POOL_SIZE = 4
+POOL_IDLE_TIMEOUT = 30
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# errors that indicate a pooled connection was closed by the server while idle
+_STALE_ERRORS = (
+    http.client.RemoteDisconnected,
+    ConnectionResetError,
+    BrokenPipeError,
+    asyncio.IncompleteReadError,
+)
+_T = TypeVar("_T")
+
+
+class _UnixSocketPool:
+    """A bounded pool of keep-alive connections to the wb-svc unix socket.
+
+    Idle connections are health checked before they are reused. If the server
+    recycled the socket anyway, the request is retried once on a new connection."""
+
+    def __init__(self, unix_socket: str, size: int, idle_timeout: float):
+        """Initialize an empty pool."""
+        self._unix_socket = unix_socket
+        self._idle_timeout = idle_timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle: list[tuple[float, HTTPUnixSocketConnection]] = []
+
+    def _connect(self) -> HTTPUnixSocketConnection:
+        """Open a new connection to the socket."""
+        return HTTPUnixSocketConnection(unix_socket=self._unix_socket, timeout=QUERY_TIMEOUT)
+
+    def _is_healthy(self, conn: HTTPUnixSocketConnection, idle_since: float) -> bool:
+        """Check if an idle connection can be reused."""
+        if time.monotonic() - idle_since > self._idle_timeout or conn.sock is None:
+            return False
+        # an idle keep-alive socket has nothing to read, readable means it was closed
+        try:
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def _checkout(self) -> tuple[HTTPUnixSocketConnection, bool]:
+        """Get a healthy idle connection or a new one. Also returns if it was reused."""
+        with self._lock:
+            while self._idle:
+                idle_since, conn = self._idle.pop()
+                if self._is_healthy(conn, idle_since):
+                    return conn, True
+                conn.close()
+        return self._connect(), False
+
+    def _checkin(self, conn: HTTPUnixSocketConnection):
+        """Return a connection to the idle list."""
+        with self._lock:
+            self._idle.append((time.monotonic(), conn))
+
+    @staticmethod
+    def _send(conn: HTTPUnixSocketConnection, path: str, body: str) -> http.client.HTTPResponse:
+        """Send a POST and wait for the response headers."""
+        conn.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+        return conn.getresponse()
+
+    @contextmanager
+    def request(self, path: str, body: str) -> Iterator[http.client.HTTPResponse]:
+        """POST a body to the socket using a pooled connection and yield the response.
+
+        The connection is only returned to the pool if the response was read to the end."""
+        if not self._slots.acquire(timeout=QUERY_TIMEOUT):
+            raise TimeoutError("Timed out waiting for a wb-svc connection.")
+        try:
+            conn, reused = self._checkout()
+            try:
+                try:
+                    response = self._send(conn, path, body)
+                except _STALE_ERRORS:
+                    if not reused:
+                        raise
+                    conn.close()
+                    conn = self._connect()
+                    response = self._send(conn, path, body)
+            except BaseException:
+                conn.close()
+                raise
+
+            try:
+                yield response
+            finally:
+                if response.isclosed() and not response.will_close:
+                    self._checkin(conn)
+                else:
+                    conn.close()
+        finally:
+            self._slots.release()
+
+    def post(self, path: str, body: str) -> bytes:
+        """POST a body to the socket using a pooled connection."""
+        with self.request(path, body) as response:
+            return response.read()
+
+
+_POOL_LOCK = threading.Lock()
+_UNIX_POOL: None | _UnixSocketPool = None
+_TCP_SESSION: None | requests.Session = None
+
+
+def _unix_pool() -> _UnixSocketPool:
+    """Get the shared unix socket connection pool."""
+    global _UNIX_POOL  # pylint: disable=global-statement
+    with _POOL_LOCK:
+        if _UNIX_POOL is None:
+            _UNIX_POOL = _UnixSocketPool(GQL_SOCKET, POOL_SIZE, POOL_IDLE_TIMEOUT)
+        return _UNIX_POOL
+
+
+def _tcp_session() -> requests.Session:
+    """Get the shared keep-alive session for the NVWB_API transport."""
+    global _TCP_SESSION  # pylint: disable=global-statement
+    with _POOL_LOCK:
+        if _TCP_SESSION is None:
+            # urllib3 drops dead idle connections on checkout, the retry covers a recycle mid request
+            retries = Retry(total=1, connect=1, read=1, status=0, allowed_methods=None)
+            # requests can not bound the wait for a free pooled connection, so a burst over
+            # POOL_SIZE opens extra connections that are closed when they are returned
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, pool_block=False, max_retries=retries)
+            _TCP_SESSION = requests.Session()
+            _TCP_SESSION.mount("http://", adapter)
+        return _TCP_SESSION
+
+
+@dataclass
+class SingleFlightStats:
+    """Counts of wb-svc requests and how many of them shared another in-flight request."""
+
+    requests: int = 0
+    collapsed: int = 0
+
+
+class _Flight:
+    """A request that is in flight."""
+
+    def __init__(self):
+        """Initialize a pending flight."""
+        self.done = threading.Event()
+        self.result: bytes = b""
+        self.error: None | BaseException = None
+
+
+class _SingleFlight:
+    """Collapse concurrent identical requests into one.
+
+    The first caller for a key makes the request. Callers that arrive while it is
+    in flight wait for it and receive the same response."""
+
+    def __init__(self):
+        """Initialize with nothing in flight."""
+        self._lock = threading.Lock()
+        self._flights: dict[str, _Flight] = {}
+        self._aflights: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, asyncio.Future]] = (
+            weakref.WeakKeyDictionary()
+        )
+        self._stats = SingleFlightStats()
+
+    @property
+    def stats(self) -> SingleFlightStats:
+        """A copy of the current counters."""
+        with self._lock:
+            return replace(self._stats)
+
+    def do(self, key: str, fun: Callable[[], bytes]) -> bytes:
+        """Run fun, or wait for the identical call that is already in flight."""
+        with self._lock:
+            self._stats.requests += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+            else:
+                self._stats.collapsed += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fun()
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    async def ado(self, key: str, fun: Callable[[], Coroutine[Any, Any, bytes]]) -> bytes:
+        """Await fun, or the identical call that is already in flight on this loop.
+
+        The call runs as its own task, so a caller that is cancelled stops waiting
+        without cancelling the call for the others."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._stats.requests += 1
+            flights = self._aflights.setdefault(loop, {})
+            task = flights.get(key)
+            if task is None:
+                task = flights[key] = loop.create_task(fun())
+                task.add_done_callback(lambda done: self._landed(flights, key, done))
+            else:
+                self._stats.collapsed += 1
+        return await asyncio.shield(task)
+
+    def _landed(self, flights: dict[str, asyncio.Future], key: str, task: asyncio.Future):
+        """Forget a finished call."""
+        with self._lock:
+            if flights.get(key) is task:
+                del flights[key]
+        if not task.cancelled():
+            # mark the exception as retrieved in case every caller was cancelled
+            task.exception()
+
+
+_SINGLE_FLIGHT = _SingleFlight()
+
+
+def single_flight_stats() -> SingleFlightStats:
+    """Get how many requests were made and how many were collapsed into an in-flight one."""
+    return _SINGLE_FLIGHT.stats
+
+
+def _post(api_host: None | str, body: str) -> bytes:
+    """POST a JSON body to wb-svc on the pooled transport."""
+    if api_host:
+        req = _tcp_session().post(
+            f"http://{api_host}{GQL_PATH}",
+            data=body.encode("UTF-8"),
+            headers={"Content-Type": "application/json"},
+            timeout=QUERY_TIMEOUT,
+        )
+        return req.content
+
+    return _unix_pool().post(GQL_PATH, body)
+
+
+def post(body: str) -> bytes:
+    """POST a JSON body to wb-svc and return the response body."""
+    api_host = os.getenv("NVWB_API") or None
+    return _SINGLE_FLIGHT.do(f"{api_host}\n{body}", lambda: _post(api_host, body))
+
+
+@contextmanager
+def stream(body: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[Iterator[bytes]]:
+    """POST a JSON body to wb-svc and iterate over the response body as it arrives.
+
+    Streams are not coalesced by the single-flight layer. Leaving the block before
+    the response was read to the end drops the connection instead of pooling it."""
+    api_host = os.getenv("NVWB_API") or None
+    if api_host:
+        req = _tcp_session().post(
+            f"http://{api_host}{GQL_PATH}",
+            data=body.encode("UTF-8"),
+            headers={"Content-Type": "application/json"},
+            timeout=QUERY_TIMEOUT,
+            stream=True,
+        )
+        try:
+            yield req.iter_content(chunk_size)
+        finally:
+            req.close()
+        return
+
+    with _unix_pool().request(GQL_PATH, body) as response:
+        yield iter(partial(response.read, chunk_size), b"")
+
+
+async def _read_response(reader: asyncio.StreamReader) -> tuple[bool, bytes]:
+    """Read an HTTP/1.1 response. Also returns if the connection may be kept alive."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError("wb-svc closed the connection.")
+
+    headers: dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+
+    keep_alive = status_line.startswith(b"HTTP/1.1") and headers.get("connection", "").lower() != "close"
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                # skip the trailers
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        return keep_alive, b"".join(chunks)
+    if "content-length" in headers:
+        return keep_alive, await reader.readexactly(int(headers["content-length"]))
+    return False, await reader.read()
+
+
+class _AsyncStreamPool:
+    """A bounded pool of keep-alive asyncio stream connections to wb-svc.
+
+    This mirrors the blocking unix socket pool. Streams belong to an event loop,
+    so there is one of these per loop."""
+
+    def __init__(self, size: int, idle_timeout: float):
+        """Initialize an empty pool."""
+        self._idle_timeout = idle_timeout
+        self._slots = asyncio.Semaphore(size)
+        self._idle: dict[str, list[tuple[float, asyncio.StreamReader, asyncio.StreamWriter]]] = {}
+
+    @staticmethod
+    async def _connect(api_host: None | str) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """Open a new connection to the socket or the API host."""
+        if api_host:
+            host, _, port = api_host.rpartition(":")
+            return await asyncio.open_connection(host or api_host, int(port) if host else 80)
+        return await asyncio.open_unix_connection(GQL_SOCKET)
+
+    def _checkout(self, endpoint: str) -> None | tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """Get a healthy idle connection, if there is one."""
+        idle = self._idle.get(endpoint, [])
+        while idle:
+            idle_since, reader, writer = idle.pop()
+            stale = time.monotonic() - idle_since > self._idle_timeout
+            # the loop feeds eof to idle streams that the server has closed
+            if stale or writer.is_closing() or reader.at_eof():
+                writer.close()
+                continue
+            return reader, writer
+        return None
+
+    @staticmethod
+    async def _send(reader, writer, api_host: None | str, body: bytes) -> tuple[bool, bytes]:
+        """Send a POST and read the full response."""
+        head = (
+            f"POST {GQL_PATH} HTTP/1.1\r\n"
+            f"Host: {api_host or 'localhost'}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+        return await _read_response(reader)
+
+    async def post(self, body: str) -> bytes:
+        """POST a body to wb-svc using a pooled connection."""
+        api_host = os.getenv("NVWB_API") or None
+        endpoint = api_host or GQL_SOCKET
+        payload = body.encode("UTF-8")
+
+        async with self._slots:
+            conn = self._checkout(endpoint)
+            reused = conn is not None
+            reader, writer = conn or await self._connect(api_host)
+            try:
+                try:
+                    request = self._send(reader, writer, api_host, payload)
+                    keep_alive, data = await asyncio.wait_for(request, QUERY_TIMEOUT)
+                except _STALE_ERRORS:
+                    if not reused:
+                        raise
+                    writer.close()
+                    reader, writer = await self._connect(api_host)
+                    request = self._send(reader, writer, api_host, payload)
+                    keep_alive, data = await asyncio.wait_for(request, QUERY_TIMEOUT)
+            except BaseException:
+                writer.close()
+                raise
+
+            if keep_alive:
+                self._idle.setdefault(endpoint, []).append((time.monotonic(), reader, writer))
+            else:
+                writer.close()
+            return data
+
+
+_ASYNC_POOLS: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _AsyncStreamPool] = weakref.WeakKeyDictionary()
+_CLIENT_LOOP: None | asyncio.AbstractEventLoop = None
+
+
+async def apost(body: str) -> bytes:
+    """POST a JSON body to wb-svc from a coroutine and return the response body."""
+    loop = asyncio.get_running_loop()
+    pool = _ASYNC_POOLS.get(loop)
+    if pool is None:
+        pool = _ASYNC_POOLS[loop] = _AsyncStreamPool(POOL_SIZE, POOL_IDLE_TIMEOUT)
+    api_host = os.getenv("NVWB_API") or None
+    return await _SINGLE_FLIGHT.ado(f"{api_host}\n{body}", lambda: pool.post(body))
+
+
+def _client_loop() -> asyncio.AbstractEventLoop:
+    """Get the shared client event loop, starting it if needed."""
+    global _CLIENT_LOOP  # pylint: disable=global-statement
+    with _POOL_LOCK:
+        if _CLIENT_LOOP is None:
+            _CLIENT_LOOP = asyncio.new_event_loop()
+            threading.Thread(target=_CLIENT_LOOP.run_forever, name="wb-svc-client", daemon=True).start()
+        return _CLIENT_LOOP
+
+
+def run(coro: Coroutine[Any, Any, _T]) -> _T:
+    """Run a coroutine on the shared client loop and wait for the result.
+
+    Using one long lived loop lets the asyncio pool keep its connections between calls."""
+    return asyncio.run_coroutine_threadsafe(coro, _client_loop()).result()
@@ -15,16 +15,15 @@
 """Tests for auto continuing associated tasks."""
 from typing import Any
 from pathlib import Path
+import os
 import sys
 
 try:
-    from common import testing
-    from common import wb_svc_client
+    from common import fs_watch, testing
 except ImportError:
     # this helps with debugging and allows direct importing or execution
     sys.path.append("..")
-    from common import testing
-    from common import wb_svc_client
+    from common import fs_watch, testing
 
 
 PROJECT_NAME = "nvidia-ai-workbench-onboarding"
@@ -34,63 +33,64 @@ FOLDER_NAME = "my-first-folder"
 FILE_NAME = "delete-me.txt"
 CODE_FOLDER_NAME = "code"
 DELETE_ME_FILE_NAME = "delete-me.txt"
+EXAMPLE_FILE_NAME = "example-file.txt"
+EXAMPLE_FILE_CONTENTS = b"this is an example"
+# whether the example file was edited, as of the directory entry it was last read at
+_EXAMPLE_FILE_STATE: None | tuple[fs_watch.Entry, bool] = None
 
 UBUNTU_PACKAGE = "jq"
 
+@testing.reads()
 def check_folder_exists() -> dict[str, Any]:
     """Ensure the folder is created."""
     _ = testing.get_folder(PROJECT_NAME, ROOT_DIR, FOLDER_NAME)
 
 
 
-def check_file_in_folder() -> dict[str, Any]:
+@testing.reads()
+def check_file_in_folder() -> None:
     """Check if any file exists in my-first-folder."""
-    import os
-    
-    folder_path = os.path.join(PROJECT_DIR, FOLDER_NAME)
+    names = fs_watch.WATCHER.listdir(os.path.join(PROJECT_DIR, FOLDER_NAME)) or []
     # Check for any non-hidden file
-    for filename in os.listdir(folder_path):
-        if not filename.startswith('.'):
-            return None  # Found at least one non-hidden file
-            
-    raise testing.TestFail("info_wait_for_file_upload")
-    
-    # Don't return anything, just like other test functions
-
-def check_file_deleted() -> dict[str, Any]:
+    if not any(not filename.startswith(".") for filename in names):
+        raise testing.TestFail("info_wait_for_file_upload")
+
+
+@testing.reads()
+def check_file_deleted() -> None:
     """Check if the file is deleted."""
-    import os
-    
-    folder_path = os.path.join(PROJECT_DIR, CODE_FOLDER_NAME)
-    
-    # Check if delete-me.txt still exists
-    if os.path.exists(os.path.join(folder_path, DELETE_ME_FILE_NAME)):
+    if fs_watch.WATCHER.exists(os.path.join(PROJECT_DIR, CODE_FOLDER_NAME, DELETE_ME_FILE_NAME)):
         raise testing.TestFail("info_wait_for_delete")
-            
-    return None
 
-def check_file_changed() -> dict[str, Any]:
+
+@testing.reads()
+def check_file_changed() -> None:
     """Check if example-file.txt has been modified."""
-    import os
-    
-    file_path = os.path.join(PROJECT_DIR, CODE_FOLDER_NAME, "example-file.txt")
-    
-    # Read the file contents
-    with open(file_path, 'r') as f:
-        content = f.read().strip()
-    
-    # Check if content is different from original
-    if content == "this is an example":
+    global _EXAMPLE_FILE_STATE  # pylint: disable=global-statement
+    file_path = os.path.join(PROJECT_DIR, CODE_FOLDER_NAME, EXAMPLE_FILE_NAME)
+
+    # only read the file again when its size or modification time changed
+    entry = fs_watch.WATCHER.entry(file_path)
+    state = _EXAMPLE_FILE_STATE
+    if entry is not None and (state is None or state[0] != entry):
+        try:
+            edited = Path(file_path).read_bytes().strip() != EXAMPLE_FILE_CONTENTS
+        except (FileNotFoundError, IsADirectoryError):
+            edited = False
+        state = _EXAMPLE_FILE_STATE = (entry, edited)
+
+    # a missing file has not been edited yet either
+    if entry is None or state is None or not state[1]:
         raise testing.TestFail("info_wait_for_edit")
-            
-    return None
-    
 
+
+@testing.reads(testing.PACKAGE_FIELDS)
 def add_ubuntu_package():
     """Wait for the package to be added."""
     testing.ensure_package(PROJECT_NAME, "apt", UBUNTU_PACKAGE)
 
 
+@testing.reads(testing.GPU_FIELDS)
 def ensure_gpu_count() -> int:
     """Ensure that a project has at least one GPU assigned.
 
@@ -98,21 +98,12 @@ def ensure_gpu_count() -> int:
         - info_no_gpu_assigned
         - info_wait_for_project
     """
-    response = wb_svc_client.get_gpu_request(PROJECT_NAME) or {}
-    gpu_count = (
-        response.get("data", {})
-                .get("project", {})
-                .get("resources", {})
-                .get("gpusRequested")
-    )
-
-    if gpu_count is None:
-        raise testing.TestFail("info_wait_for_project")
-
+    gpu_count = testing.ensure_gpu_count(PROJECT_NAME)
     if gpu_count < 1:
         raise testing.TestFail("info_no_gpu_assigned")
 
 
+@testing.reads(testing.CHANGES_FIELDS)
 def check_changes_discarded() -> None:
     """Check that the user has discarded all changes to the project."""
     testing.ensure_changes_discarded(PROJECT_NAME)
@@ -34,11 +34,13 @@ PYTHON_PACKAGE_2 = "numpy"
 UBUNTU_PACKAGE = "jq"
 
 
+@testing.reads()
 def create_a_brand_new_project():
     """Ensure my-first-project is created."""
     _ = testing.get_project(PROJECT_NAME)
 
 
+@testing.reads(testing.BUILD_FIELDS)
 def wait_for_project_build():
     """Wait for the project to finish building."""
     project = testing.get_project(PROJECT_NAME)
@@ -46,6 +48,7 @@ def wait_for_project_build():
     testing.ensure_build_state(project, target)
 
 
+@testing.reads(testing.RUN_FIELDS)
 def wait_for_project_start():
     """Wait for the project to finish starting."""
     project = testing.get_project(PROJECT_NAME)
@@ -53,12 +56,14 @@ def wait_for_project_start():
     testing.ensure_run_state(project, target)
 
 
+@testing.reads(testing.APP_FIELDS)
 def wait_for_jupyterlab_to_exist() -> dict[str, Any]:
     """Wait for the JupyterLab application to exist."""
     project = testing.get_project(PROJECT_NAME)
     _ = testing.get_app(project, JUPYTER_NAME)
 
 
+@testing.reads(testing.APP_FIELDS)
 def wait_for_jupyterlab_start():
     """Wait for the JupyterLab app to be running."""
     project = testing.get_project(PROJECT_NAME)
@@ -67,48 +72,45 @@ def wait_for_jupyterlab_start():
     testing.ensure_app_state(app, target)
 
 
+@testing.reads()
 def create_a_new_notebook() -> dict[str, Any]:
     """Ensure my-first-project is created."""
-    _ = testing.get_file(PROJECT_NAME, IPYNB_DIR, IPYNB_FILE)
+    _ = testing.file_exists(PROJECT_NAME, IPYNB_DIR, IPYNB_FILE)
 
 
+@testing.reads()
 def write_some_code():
     """Wait for some code plotly code to be in the notebook."""
-    contents = testing.get_file(PROJECT_NAME, IPYNB_DIR, IPYNB_FILE)
-    if "plotly" not in contents.decode("UTF-8"):
-        raise testing.TestFail("info_wait_for_code")
+    testing.ensure_file_contains(PROJECT_NAME, IPYNB_DIR, IPYNB_FILE, b"plotly")
 
 
+@testing.reads(testing.PACKAGE_FIELDS)
 def add_python_packages():
     """Wait for the package to be added."""
-    pkg = testing.ensure_package(PROJECT_NAME, "pip", PYTHON_PACKAGE_1)
-    pkg = testing.ensure_package(PROJECT_NAME, "pip", PYTHON_PACKAGE_2)
-    return pkg
+    packages = testing.ensure_packages(PROJECT_NAME, {"pip": [PYTHON_PACKAGE_1, PYTHON_PACKAGE_2]})
+    return packages["pip"][-1]
 
+@testing.reads()
 def add_ubuntu_package():
 #    """Wait for the package to be added."""
 #    testing.ensure_package(PROJECT_NAME, "apt", UBUNTU_PACKAGE)
 
-    """Check if 'jq' appears in the file."""
-    import os
-    
-    file_path = os.path.join(PROJECT_DIR, "apt.txt")
-    
-    with open(file_path, 'r') as f:
-        content = testing.get_file(PROJECT_NAME, ".", "apt.txt").decode('UTF-8')
-    
-    if "jq" not in content:
-        raise testing.TestFail("info_wait_for_package")
-            
-    return None
+    """Check if the package appears in apt.txt."""
+    try:
+        testing.ensure_file_contains(PROJECT_NAME, ".", "apt.txt", UBUNTU_PACKAGE.encode("UTF-8"))
+    except testing.TestFail as exc:
+        if str(exc) == "info_wait_for_code":
+            raise testing.TestFail("info_wait_for_package") from exc
+        raise
 
 
+@testing.reads()
+@testing.requires(wait_for_project_build, wait_for_project_start)
 def rebuild_environment():
     """Wait for the environment to rebuild and restart."""
-    wait_for_project_build()
-    wait_for_project_start()
 
 
+@testing.reads(testing.RUN_FIELDS)
 def wait_for_project_stop():
     """Wait for the project to stop."""
     project = testing.get_project(PROJECT_NAME)
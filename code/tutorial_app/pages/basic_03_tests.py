@@ -14,16 +14,17 @@
 # limitations under the License.
 """Tests for auto continuing associated tasks."""
 import sys
-from typing import Any
 
 try:
+    from common import testing
+    from common.snapshot import ProjectSnapshot
     from common.testing import TestFail
-    from common import wb_svc_client
 except ImportError:
     # this helps with debugging and allows direct importing or execution
     sys.path.append("..")
+    from common import testing
+    from common.snapshot import ProjectSnapshot
     from common.testing import TestFail
-    from common import wb_svc_client
 
 PROJECT_NAME = "my-first-project"
 BRANCH_NAME = "my-first-branch"
@@ -31,25 +32,30 @@ BRANCH_NAME = "my-first-branch"
 # TODO: add step to setup git server integration
 
 
-def get_project() -> dict[str, Any]:
-    """Get the working project."""
-    return wb_svc_client.get_project(PROJECT_NAME) or {}
+def get_project(message: str) -> ProjectSnapshot:
+    """Get the working project, fail the test with message if it doesn't exist."""
+    try:
+        return testing.get_project(PROJECT_NAME)
+    except TestFail as exc:
+        raise TestFail(message) from exc
 
 
+@testing.reads("repoState.changes.file")
 def wait_for_commit():
     """Wait for the repo changes to be committed."""
-    proj = get_project()
-    changes = proj.get("data", {}).get("project", {}).get("repoState", {}).get("changes")
+    proj = get_project("info_wait_for_commit")
+    changes = (proj.get("repoState") or {}).get("changes")
     num_changes = len(changes) if changes else 0
 
     if num_changes > 0:
         raise TestFail("info_wait_for_commit")
 
 
+@testing.reads("remoteUrl")
 def wait_for_publish() -> str:
     """Wait for the repo to be published."""
-    proj = get_project()
-    url = proj.get("data", {}).get("project", {}).get("remoteUrl")
+    proj = get_project("info_wait_for_publish")
+    url = proj.get("remoteUrl")
 
     if url is None:
         raise TestFail("info_wait_for_publish")
@@ -57,45 +63,50 @@ def wait_for_publish() -> str:
     return url
 
 
+@testing.reads("repoState.commitsBehind")
 def wait_for_remote_changes():
     """Wait for the repo to be published."""
-    proj = get_project()
-    behind = proj.get("data", {}).get("project", {}).get("repoState", {}).get("commitsBehind")
+    proj = get_project("info_wait_for_remote_changes")
+    behind = (proj.get("repoState") or {}).get("commitsBehind")
 
     if behind == 0:
         raise TestFail("info_wait_for_remote_changes")
 
 
+@testing.reads("repoState.commitsBehind")
 def wait_for_remote_changes_sync():
     """Wait for the repo to be synced."""
-    proj = get_project()
-    behind = proj.get("data", {}).get("project", {}).get("repoState", {}).get("commitsBehind")
+    proj = get_project("info_wait_for_remote_changes_sync")
+    behind = (proj.get("repoState") or {}).get("commitsBehind")
 
     if behind > 0:
         raise TestFail("info_wait_for_remote_changes_sync")
 
 
+@testing.reads("gitBranches.name")
 def wait_for_branch():
     """Wait for branch to exist."""
-    proj = get_project()
-    branches = proj.get("data", {}).get("project", {}).get("gitBranches", [])
+    proj = get_project("info_wait_for_branch")
+    branches = proj.get("gitBranches") or []
 
     if {"name": BRANCH_NAME} not in branches:
         raise TestFail("info_wait_for_branch")
 
 
+@testing.reads()
 def wait_for_no_proj():
     """Wait for the project to be deleted."""
-    proj = get_project()
-    if proj != {}:
-        raise TestFail("info_wait_for_no_proj")
+    try:
+        get_project("info_wait_for_no_proj")
+    except TestFail:
+        return
+    raise TestFail("info_wait_for_no_proj")
 
 
+@testing.reads()
 def wait_for_proj():
     """Wait for the project to be deleted."""
-    proj = get_project()
-    if proj == {}:
-        raise TestFail("info_wait_for_proj")
+    get_project("info_wait_for_proj")
 
 
 if __name__ == "__main__":
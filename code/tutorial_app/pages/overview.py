@@ -25,13 +25,14 @@ MESSAGES = localization.load_messages(__file__)
 NAME = Path(__file__).stem
 COMPLETED_TASKS = 0
 
-with theme.Theme():
+with theme.Theme(fragments=True):
     # Header
     st.title(MESSAGES.get("title"))
     st.write(MESSAGES.get("welcome_msg"))
     st.header(MESSAGES.get("header"), divider="gray")
 
     # Print Tasks
+    theme.evaluate_tasks(NAME, MESSAGES, TESTS)
     for task in MESSAGES.get("tasks", []):
         if not theme.print_task(NAME, task, TESTS, MESSAGES):
             break
@@ -39,6 +39,7 @@ PROJECT_NAME = "nvidia-ai-workbench-onboarding"
 JUPYTER_NAME = "jupyterlab"
 
 
+@testing.reads(testing.APP_FIELDS)
 def wait_for_jupyterlab_start():
     """Wait for the JupyterLab app to be running."""
     project = testing.get_project(PROJECT_NAME)  # Use testing module's version
@@ -47,6 +48,7 @@ def wait_for_jupyterlab_start():
     testing.ensure_app_state(app, target)
 
 
+@testing.reads(testing.APP_FIELDS)
 def wait_for_jupyterlab_stop():
     """Wait for the JupyterLab app to stop running."""
     project = testing.get_project(PROJECT_NAME)
@@ -55,6 +57,8 @@ def wait_for_jupyterlab_stop():
     testing.ensure_app_state(app, target)
     
 
+@testing.reads()
+@testing.sequential
 def wait_three_times():
     """Wait for a few calls."""
     for idx in range(3):
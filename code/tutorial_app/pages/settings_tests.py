@@ -13,7 +13,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Tests for auto continuing associated tasks."""
-from pathlib import Path
 import sys
 
 import streamlit as st
@@ -29,21 +28,17 @@ PROJECTS = ["my-first-project", "custom-application-project", "multi-container-p
 INFO_MSG = ["info_first_project", "info_custom_app_proj", "info_multi_container_proj"]
 
 
+@testing.sequential
 def wait_for_clean():
     """Wait for the projects to be deleted."""
     # wait for user to delete projects
+    existing = testing.find_projects(PROJECTS, fields="name")
     for idx, project in enumerate(PROJECTS):
-        try:
-            _ = testing.get_project(project)
-        except testing.TestFail:
-            continue
-        raise testing.TestFail(INFO_MSG[idx])
+        if project in existing:
+            raise testing.TestFail(INFO_MSG[idx])
 
     # remove the cached state
-    try:
-        Path(theme.STATE_FILE).unlink()
-    except FileNotFoundError:
-        pass
+    theme.clear_state()
 
     # clear the state
     keys = list(st.session_state.keys())